@@ -9,12 +9,27 @@
 
 import socket 
 import binascii
+import collections
 import functools
+import re
 import struct
 import os
+import select
+import threading
 import time 
 
+#numpy is only needed by readImages and Frame.toArray
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
 BUFFER_SIZE = 2048
+CHUNK_SIZE  = 65536
+#Granularity of cancellation checks while waiting for data, in seconds
+POLL_INTERVAL = 0.05
+#Maximum time for the detector to return to Idle. after an abort, in seconds
+ABORT_TIMEOUT = 10.0
 
 
 class DetectorStatus(object):
@@ -79,10 +94,236 @@ class Global_Config(object):
 class Xpad_Error(BaseException):
 	pass
 
+class Xpad_Timeout(Xpad_Error):
+	pass
+
+class Xpad_Cancelled(Xpad_Error):
+	pass
+
+
+#Shared between the thread running an acquisition or a calibration and the thread
+#that wants to stop it. After the cancellation has been handled, abortLatency holds
+#the time (s) the detector took to return to Idle.
+class CancelToken(object):
+	def __init__(self):
+		self.event = threading.Event()
+		self.abortLatency = None
+
+	def cancel(self):
+		self.event.set()
+
+	def isCancelled(self):
+		return self.event.is_set()
+
+
+def deadlineFrom(timeout):
+	if timeout is None:
+		return None
+	return time.monotonic() + timeout
+
+#Parse the "key=value;key=value;" lists returned by the temperature and information commands
+def parseKeyValueList(text):
+	values = {}
+	for item in text.split(';'):
+		if '=' in item:
+			key, value = item.split('=', 1)
+			values[key.strip()] = value.strip()
+	return values
+
+
+#Static information of a detector, read once by XpadCamera.getDetectorInfo
+DetectorInfo = collections.namedtuple("DetectorInfo",
+	("detectorType", "detectorModel", "moduleMask", "moduleNumber", "imageHeight", "imageWidth", "firmwareID"))
+#field of DetectorInfo and server command answering it
+DETECTOR_INFO_QUERIES = (
+	("detectorType",	"GetDetectorType"),
+	("detectorModel",	"GetDetectorModel"),
+	("moduleMask",		"getModuleMask"),
+	("moduleNumber",	"GetModuleNumber"),
+	("imageSize",		"GetImageSize"),
+	("firmwareID",		"getfirmwareID"),
+)
+
+
+#One received image. data is the raw int32 little endian buffer, headerTime and
+#completeTime the time.monotonic() values at header arrival and at the last byte.
+class Frame(object):
+	__slots__ = ("data", "height", "width", "index", "headerTime", "completeTime")
+
+	def __init__(self, data, height, width, index, headerTime, completeTime):
+		self.data = data
+		self.height = height
+		self.width = width
+		self.index = index
+		self.headerTime = headerTime
+		self.completeTime = completeTime
+
+	#(height, width) int32 array sharing the frame buffer
+	def toArray(self):
+		return np.frombuffer(self.data, dtype='<i4').reshape(self.height, self.width)
+
+
+def percentile(sortedValues, p):
+	if not sortedValues:
+		return None
+	pos = (len(sortedValues) - 1) * p / 100.0
+	low = int(pos)
+	high = min(low + 1, len(sortedValues) - 1)
+	return sortedValues[low] + (sortedValues[high] - sortedValues[low]) * (pos - low)
+
+
+#Timing of one acquisition: add() every Frame, then summary() gives the effective
+#frame rate, inter-frame interval and jitter percentiles, missing frames against the
+#expected count (see XpadCamera.getExpectedFrameCount) and the gaps, i.e. intervals
+#longer than gapFactor times the median interval.
+class AcquisitionStats(object):
+	def __init__(self, expected=None, gapFactor=2.0):
+		self.expected = expected
+		self.gapFactor = gapFactor
+		self.headerTimes = []
+		self.transferTimes = []
+		self.nbBytes = 0
+		self.lastCompleteTime = None
+
+	def add(self, frame):
+		self.headerTimes.append(frame.headerTime)
+		self.transferTimes.append(frame.completeTime - frame.headerTime)
+		self.nbBytes += len(frame.data)
+		self.lastCompleteTime = frame.completeTime
+
+	def summary(self):
+		nb = len(self.headerTimes)
+		intervals = [b - a for a, b in zip(self.headerTimes, self.headerTimes[1:])]
+		sortedIntervals = sorted(intervals)
+		median = percentile(sortedIntervals, 50)
+		jitter = sorted(abs(i - median) for i in intervals) if intervals else []
+		gaps = []
+		if median:
+			gaps = [(i + 1, interval) for i, interval in enumerate(intervals) if interval > self.gapFactor * median]
+		span = self.headerTimes[-1] - self.headerTimes[0] if nb > 1 else 0.0
+		elapsed = self.lastCompleteTime - self.headerTimes[0] if nb else 0.0
+		result = {
+			"frames"			: nb,
+			"expected"			: self.expected,
+			"missing"			: max(self.expected - nb, 0) if self.expected is not None else None,
+			"bytes"				: self.nbBytes,
+			"frame_rate"		: (nb - 1) / span if span > 0 else None,
+			"throughput"		: self.nbBytes / elapsed if elapsed > 0 else None,
+			"interval_median"	: median,
+			"interval_p99"		: percentile(sortedIntervals, 99),
+			"interval_max"		: sortedIntervals[-1] if sortedIntervals else None,
+			"jitter_p50"		: percentile(jitter, 50),
+			"jitter_p90"		: percentile(jitter, 90),
+			"jitter_p99"		: percentile(jitter, 99),
+			"transfer_p50"		: percentile(sorted(self.transferTimes), 50),
+			"gaps"				: gaps,
+		}
+		return result
+
+
+#Transports open the sockets used by XpadCamera. connect(ip, port) returns a
+#connected, blocking stream socket.
+
+#TCP connection with TCP_NODELAY (the per-frame "OK" ACK is a small write that
+#Nagle's algorithm and delayed ACKs would otherwise hold back), optional socket
+#buffer sizes and keepalive.
+class TcpTransport(object):
+	name = "tcp"
+
+	def __init__(self, noDelay=True, recvBufferSize=None, sendBufferSize=None, keepAlive=True, connectTimeout=None):
+		self.noDelay = noDelay
+		self.recvBufferSize = recvBufferSize
+		self.sendBufferSize = sendBufferSize
+		self.keepAlive = keepAlive
+		self.connectTimeout = connectTimeout
+
+	def connect(self, ip, port):
+		sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		try:
+			#buffer sizes must be set before connect to be taken into account for the TCP window
+			if self.recvBufferSize:
+				sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.recvBufferSize)
+			if self.sendBufferSize:
+				sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sendBufferSize)
+			if self.keepAlive:
+				sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+			if self.noDelay:
+				sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+			sock.settimeout(self.connectTimeout)
+			sock.connect((ip, port))
+			sock.settimeout(None)
+		except socket.error:
+			sock.close()
+			raise
+		return sock
+
+#Unix domain socket, for a client running on the server host. ip and port are ignored.
+class UnixTransport(object):
+	name = "unix"
+
+	def __init__(self, path, recvBufferSize=None, sendBufferSize=None):
+		self.path = path
+		self.recvBufferSize = recvBufferSize
+		self.sendBufferSize = sendBufferSize
+
+	def connect(self, ip, port):
+		sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			if self.recvBufferSize:
+				sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.recvBufferSize)
+			if self.sendBufferSize:
+				sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sendBufferSize)
+			sock.connect(self.path)
+		except socket.error:
+			sock.close()
+			raise
+		return sock
+
+#In-process transport for tests. Every connect creates a socket pair and runs
+#handler(serverSocket) in a daemon thread to play the server side.
+class MemoryTransport(object):
+	name = "memory"
+
+	def __init__(self, handler):
+		self.handler = handler
+
+	def connect(self, ip, port):
+		clientSock, serverSock = socket.socketpair()
+		thread = threading.Thread(target=self.handler, args=(serverSock,))
+		thread.daemon = True
+		thread.start()
+		return clientSock
+
+
+#Every command holds the lock of the socket it talks on for the whole exchange,
+#so that one XpadCamera can be shared between threads. The two sockets have their
+#own lock: status and abort requests never wait for an image transfer.
+#When camera.metrics is set (see xpadMetrics) the duration of each command is recorded.
+def lockMainSocket(method):
+	@functools.wraps(method)
+	def wrapper(self, *args, **kwargs):
+		with self.mainLock:
+			if self.metrics is None:
+				return method(self, *args, **kwargs)
+			return self.metrics.timeCommand(method, self, args, kwargs)
+	return wrapper
+
+def lockStatusSocket(method):
+	@functools.wraps(method)
+	def wrapper(self, *args, **kwargs):
+		with self.statusLock:
+			if self.metrics is None:
+				return method(self, *args, **kwargs)
+			return self.metrics.timeCommand(method, self, args, kwargs)
+	return wrapper
+
+
 class XpadCamera:
-	def __init__(self,ip,port):
+#recorder (see xpadCapture.SessionRecorder) logs all the traffic of both sockets
+	def __init__(self,ip,port,transport=None,recorder=None):
 		#DefaultValue
 		self.moduleMask  = 0
+		self.detectorModel = None
 		self.ImageHeight = -1
 		self.ImageWidth  = -1
 		self.geometricalCorrectionFlag = True
@@ -98,29 +339,206 @@ class XpadCamera:
 		self.acquistionMode = 0
 		self.nbStack = 1
 		self.outputServerFilePath = "/opt/cegitek/tmp_corrected/"				
-		self.recvBuffer = ""
-		#Main socket
-		self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-		self.sock.connect((ip, port))
+		if transport is None:
+			transport = TcpTransport()
+		self.transport = transport
+		self.mainLock = threading.RLock()
+		self.statusLock = threading.RLock()
+		self.exposureAborted = False
+		self.frameIndex = 0
+		self.metrics = None
+		self.recorder = recorder
+		self.info = None
+		#Main socket, then status and abort command socket. The status socket is
+		#opened without waiting for the main banner, so both banners arrive during a
+		#single round trip; the connections are still made in that order.
+		self.sock = transport.connect(ip, port)
+		if recorder is not None:
+			self.sock = recorder.wrap(self.sock, 0)
+		try:
+			self.sock_status = transport.connect(ip, port)
+		except:
+			self.sock.close()
+			raise
+		if recorder is not None:
+			self.sock_status = recorder.wrap(self.sock_status, 1)
 		data  = self.sock.recv(BUFFER_SIZE)	
-
-		#status and abort command
-		self.sock_status = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-		self.sock_status.connect((ip, port))
+		self.banner = data
 		data = self.sock_status.recv(BUFFER_SIZE)	
 
+#Connect and read the static detector information in one go, returns the camera
+#with camera.info set. With init the Init command is pipelined ahead of the queries.
+	@staticmethod
+	def connect(ip,port,transport=None,recorder=None,init=False):
+		camera = XpadCamera(ip, port, transport, recorder)
+		try:
+			camera.getDetectorInfo(init=init)
+		except:
+			camera.close()
+			raise
+		return camera
+
 
-	def receiveResponse(self):
-		#self.recvBuffer = ""
+#Read the main socket up to the ">" prompt and return the raw response.
+#With a deadline (time.monotonic() value) or a cancel token the wait is interrupted
+#by Xpad_Timeout or Xpad_Cancelled.
+	@lockMainSocket
+	def receiveResponse(self,deadline=None,cancelToken=None):
+		waiting = deadline is not None or cancelToken is not None
 		try:
-			ret = self.sock.recv(1)
-			self.recvBuffer = ret
-			while ret.decode() != ">":
+			data = b""
+			ret = b""
+			while ret != b">":
+				if waiting:
+					self.waitReadable(self.sock, deadline, cancelToken)
 				ret = self.sock.recv(1)
-				self.recvBuffer += ret
+				if not ret:
+					raise Xpad_Error("ERROR: Connection closed by server.")
+				data += ret
+			return data
+		except Xpad_Error:
+			raise
 		except:
 			raise Xpad_Error("ERROR: Socket ERROR.")
 
+#Block until sock has data to read, checking the deadline and the cancel token
+#every POLL_INTERVAL.
+	def waitReadable(self,sock,deadline,cancelToken):
+		while True:
+			if cancelToken is not None and cancelToken.isCancelled():
+				raise Xpad_Cancelled("Operation cancelled")
+			wait = POLL_INTERVAL if cancelToken is not None else None
+			if deadline is not None:
+				remaining = deadline - time.monotonic()
+				if remaining <= 0:
+					raise Xpad_Timeout("ERROR: Timeout waiting for the server.")
+				wait = remaining if wait is None else min(wait, remaining)
+			readable, w, x = select.select([sock], [], [], wait)
+			if readable:
+				return
+
+#Read and discard everything pending on the main socket until it stays quiet for quietTime seconds
+	@lockMainSocket
+	def drainMainSocket(self,quietTime=0.1):
+		while True:
+			readable, w, x = select.select([self.sock], [], [], quietTime)
+			if not readable:
+				return
+			if not self.sock.recv(CHUNK_SIZE):
+				return
+
+#Send AbortCurrentProcess on the status socket and wait for the detector to be Idle.
+#Returns the abort to idle latency in seconds.
+	def abortAndWaitIdle(self,timeout=ABORT_TIMEOUT,pollInterval=0.01):
+		t0 = time.monotonic()
+		self.abortCurrentProcess()
+		while self.getDetectorStatus().find(DetectorStatus.IDLE) == -1:
+			if time.monotonic() - t0 > timeout:
+				raise Xpad_Timeout("ERROR: Detector not Idle after abort.")
+			time.sleep(pollInterval)
+		return time.monotonic() - t0
+
+#Bring the detector and the main socket back to a known state after a timeout or a
+#cancellation. AbortCurrentProcess is sent on the status socket, then the main socket
+#is drained while polling the status. With sendAck the main socket carries an image
+#stream: it is read message by message and "OK" is sent once for every frame (and
+#for the abort header) the server sends, as the server waits for these ACKs before it
+#can stop; pending (see drainExposure) tells where the stream was interrupted. The
+#abort to idle latency is returned and stored in error and cancelToken.
+	@lockMainSocket
+	def recoverMainSocket(self,error=None,cancelToken=None,sendAck=False,timeout=ABORT_TIMEOUT,pending=None):
+		t0 = time.monotonic()
+		self.abortCurrentProcess()
+		latency = None
+		if sendAck:
+			self.drainExposure(t0 + timeout, pending)
+		while True:
+			readable, w, x = select.select([self.sock], [], [], POLL_INTERVAL)
+			if readable and not self.sock.recv(CHUNK_SIZE):
+				raise Xpad_Error("ERROR: Connection closed by server.")
+			if latency is None and self.getDetectorStatus().find(DetectorStatus.IDLE) != -1:
+				latency = time.monotonic() - t0
+			if not readable and latency is not None:
+				break
+			if time.monotonic() - t0 > timeout:
+				raise Xpad_Timeout("ERROR: Detector not Idle after abort.")
+		self.drainMainSocket()
+		self.exposureAborted = True
+		if error is not None:
+			error.abortLatency = latency
+		if cancelToken is not None:
+			cancelToken.abortLatency = latency
+		return latency
+
+#Read the rest of an interrupted image stream up to its final response, sending one
+#"OK" per frame and per abort header. pending is None at a message boundary, or
+#(header, missing, inResponse): the bytes of a frame header already received, the
+#payload bytes of the current frame still to come, True when the final response
+#has started.
+	@lockMainSocket
+	def drainExposure(self,deadline,pending=None):
+		ack = "OK\n".encode()
+		header, missing, inResponse = pending if pending is not None else (b"", 0, False)
+		if inResponse:
+			self.receiveResponse(deadline)
+			return
+		if missing:
+			self.discardBytes(missing, deadline)
+			self.sock.sendall(ack)
+		header = bytes(header)
+		while True:
+			if len(header) < 4:
+				header += bytes(self.receiveExact(4 - len(header), None, deadline))
+			if not self.isFrameHeader(header[:4]):
+				#final response of the exposure
+				if header.find(b">") == -1:
+					self.receiveResponse(deadline)
+				return
+			if len(header) < 12:
+				header += bytes(self.receiveExact(12 - len(header), None, deadline))
+			ImageSize = struct.unpack('<i', header[:4])[0]
+			self.discardBytes(ImageSize, deadline)
+			self.sock.sendall(ack)
+			header = b""
+
+#True when the 4 first bytes of a message are the size field of a frame header: 0
+#(abort) or the size of the frames of this detector. Before any frame is known a
+#response is recognized by its text.
+	def isFrameHeader(self,prefix):
+		size = struct.unpack('<i', prefix)[0]
+		if size == 0:
+			return True
+		if self.ImageHeight > 0 and self.ImageWidth > 0:
+			return size == 4 * self.ImageHeight * self.ImageWidth
+		return not all(c in b"\t\n\r" or 32 <= c < 127 for c in prefix)
+
+	@lockMainSocket
+	def discardBytes(self,size,deadline=None):
+		buf = bytearray(min(max(size, 1), CHUNK_SIZE))
+		view = memoryview(buf)
+		while size > 0:
+			size -= self.receiveInto(view[:min(size, len(buf))], None, deadline)
+
+#State of an image stream interrupted by error (see drainExposure)
+	def pendingState(self,error,phase,header=None,size=0):
+		received = getattr(error, "received", 0)
+		if phase == "header":
+			return (bytes(header[:received]), 0, False)
+		if phase == "payload":
+			return (b"", size - received, False)
+		return (b"", 0, True)
+
+#receiveResponse with a timeout (s) and a cancel token, recovering the main socket
+#before raising Xpad_Timeout or Xpad_Cancelled.
+	@lockMainSocket
+	def waitResponse(self,timeout=None,cancelToken=None):
+		try:
+			return self.receiveResponse(deadlineFrom(timeout), cancelToken)
+		except (Xpad_Timeout, Xpad_Cancelled) as e:
+			self.recoverMainSocket(e, cancelToken)
+			raise
+
+	@lockMainSocket
 	def clearInputMainSocket(self):
 		self.sock.setblocking(False)
 		try:
@@ -130,6 +548,7 @@ class XpadCamera:
 			pass
 		self.sock.setblocking(True)
 
+	@lockStatusSocket
 	def clearInputStatusSocket(self):
 		self.sock_status.setblocking(False)
 		try:
@@ -144,6 +563,8 @@ class XpadCamera:
 #file that is stored server in the following location: /opt/imXPAD/XPAD_SERVER/detector_model.txt.
 #Then the server will perform an AskReady operation to verify that all modules
 #in the detector are responding correctly			
+	@lockMainSocket
+	@lockStatusSocket
 	def init(self):
 		self.clearInputMainSocket()
 		self.sock.send('Init\n'.encode())
@@ -171,6 +592,7 @@ class XpadCamera:
 
 
 
+	@lockMainSocket
 	def setDebugMode(self, flag):
 		self.clearInputMainSocket()
 		
@@ -179,18 +601,19 @@ class XpadCamera:
 		else :
 			str_str = "setdebugmode False\n"		
 		self.sock.send(str_str.encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 		return self.getAckValue(data)
 
 
+	@lockMainSocket
 	def getFirmwareID(self):		
 		self.clearInputMainSocket()
 		self.sock.send("getfirmwareID\n".encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 		return self.getAckValue(data)		
 			
+	@lockMainSocket
+	@lockStatusSocket
 	def close(self):				
 		self.sock.send("Exit\n".encode())
 		self.sock.close()		
@@ -199,11 +622,11 @@ class XpadCamera:
 		
 		
 
+	@lockMainSocket
 	def askReady(self):
 		self.clearInputMainSocket()
 		self.sock.send("AskReady\n".encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 
 		if int(self.getAckValue(data)) > -1 :
 			return True
@@ -213,70 +636,125 @@ class XpadCamera:
 #This function allows to retrieve the mask of the modules available in the detector.
 #This mask is given as an integer.
 #For example, for two modules, the mask in binary will be 0 0 1 1 which decimal interpretation is 3. 		
+	@lockMainSocket
 	def getModuleMask(self):	
 		self.clearInputMainSocket()
 		self.sock.send("getModuleMask\n".encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 		self.moduleMask = self.getAckValue(data)
 			
 		return int(self.getAckValue(data))
 			
+	@lockMainSocket
 	def getModuleNumber(self):	
 		self.clearInputMainSocket()
 		self.sock.send("GetModuleNumber\n".encode())		
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 		return int (self.getAckValue(data))
 
 
+	@lockMainSocket
 	def resetDetector(self):	
 		self.clearInputMainSocket()
 		self.sock.send("ResetDetector\n".encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 			
 		if self.getAckValue(data) == "0" :
 			return True
 		else:
 			raise Xpad_Error("ERROR: Command not recognized.")
 
+	@lockMainSocket
 	def getImageSize(self):	
 		self.clearInputMainSocket()
 		self.sock.send("GetImageSize\n".encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 		return self.getAckValue(data)	
 
+	@lockMainSocket
 	def receiveImage(self,dataSize):
-			bytes_recd = 0
-			while bytes_recd < dataSize:
-				if bytes_recd == 0 :
-					chunks = self.sock.recv(8192)
-					bytes_recd = bytes_recd + len(chunks)
-				else :
-					chunk = self.sock.recv(8192)
-					chunks += chunk
-					bytes_recd = bytes_recd + len(chunk)
-			return chunks
-
+		return self.receiveExact(dataSize)
+
+#Receive exactly dataSize bytes from the main socket into one preallocated buffer.
+#progress(received, total) is called after each chunk if given.
+	@lockMainSocket
+	def receiveExact(self,dataSize,progress=None,deadline=None,cancelToken=None):
+		buf = bytearray(dataSize)
+		self.receiveInto(memoryview(buf),progress,deadline,cancelToken)
+		return buf
+
+#Fill the writable buffer view (e.g. a slice of a preallocated array) from the main socket
+	@lockMainSocket
+	def receiveInto(self,view,progress=None,deadline=None,cancelToken=None):
+		waiting = deadline is not None or cancelToken is not None
+		dataSize = view.nbytes
+		received = 0
+		while received < dataSize:
+			if waiting:
+				try:
+					self.waitReadable(self.sock, deadline, cancelToken)
+				except (Xpad_Timeout, Xpad_Cancelled) as e:
+					#bytes already received, to resynchronize the stream
+					e.received = received
+					raise
+			nb = self.sock.recv_into(view[received:], min(dataSize - received, CHUNK_SIZE))
+			if nb == 0:
+				raise Xpad_Error("ERROR: Connection closed by server.")
+			received += nb
+			if progress:
+				progress(received, dataSize)
+		return received
+
+#Stream a file from disk to the main socket, preceded by its length (int32).
+#socket.sendfile (Python 3.5) uses the zero-copy os.sendfile when the platform supports
+#it; without it the file is read and sent by chunks.
+	@lockMainSocket
+	def sendFile(self,fileName,progress=None):
+		fileSize = os.path.getsize(fileName)
+		sendfile = getattr(self.sock, "sendfile", None)
+		self.sock.sendall(struct.pack('<i',fileSize))
+		with open(fileName,'rb') as fd:
+			sent = 0
+			while sent < fileSize:
+				count = min(fileSize - sent, CHUNK_SIZE)
+				if sendfile is not None:
+					nb = sendfile(fd, sent, count)
+					if nb == 0:
+						raise Xpad_Error("ERROR: Connection closed by server.")
+				else:
+					data = fd.read(count)
+					if not data:
+						raise Xpad_Error("ERROR: File shorter than expected : " + fileName)
+					self.sock.sendall(data)
+					nb = len(data)
+				sent += nb
+				if progress:
+					progress(sent, fileSize)
+		return fileSize
+
+#Stream exactly fileSize bytes from the main socket to a file on disk.
+	@lockMainSocket
+	def receiveFile(self,fileName,fileSize,progress=None):
+		buf = bytearray(min(max(fileSize, 1), CHUNK_SIZE))
+		view = memoryview(buf)
+		received = 0
+		with open(fileName,'wb') as fd:
+			while received < fileSize:
+				nb = self.sock.recv_into(view, min(fileSize - received, len(buf)))
+				if nb == 0:
+					raise Xpad_Error("ERROR: Connection closed by server.")
+				fd.write(view[:nb])
+				received += nb
+				if progress:
+					progress(received, fileSize)
+		return received
+
+	@lockMainSocket
 	def digitalTest(self, mode):
 		loop = 0
 		flagVal = self.geometricalCorrectionFlag
 		self.setGeometricalCorrectionFlag(False)
-		self.clearInputMainSocket()
-		str_str = "DigitalTest " + mode + "\n"
-		self.sock.send(str_str.encode())		
-		data = self.readOneImage()
-		
-		tmp = self.sock.recv(BUFFER_SIZE)
-		if tmp.decode().find(">") == -1:
-			print(tmp)
-			self.sock.recv(BUFFER_SIZE)
-		else:
-			print(tmp)
-			tmp.decode().replace(">","")
-			
+		data = bytes(self.runDigitalTest(mode).data)
 
 		while(self.getDetectorStatus().find("Idle.") == -1 ):
 			loop = loop + 1
@@ -290,105 +768,272 @@ class XpadCamera:
 		else:
 			raise Xpad_Error("ERROR => Digital Test")
 		
+#DigitalTest exchange alone: the command, the test frame and the final response,
+#without touching the correction flags or polling the status. Returns the Frame.
+	@lockMainSocket
+	def runDigitalTest(self, mode, timeout=None):
+		self.clearInputMainSocket()
+		self.frameIndex = 0
+		self.sock.sendall(("DigitalTest " + mode + "\n").encode())
+		frame = self.readOneFrame(timeout)
+		self.waitResponse(timeout)
+		return frame
+
+#Static detector information (DetectorInfo), queried once per session: all the
+#queries are sent in one write and the answers read back in order, a single round
+#trip instead of one per query. With init, Init is sent first on both sockets.
+#The module mask, model and image size caches of the camera are filled too.
+	@lockMainSocket
+	@lockStatusSocket
+	def getDetectorInfo(self,refresh=False,init=False):
+		if self.info is not None and not refresh and not init:
+			return self.info
+		commands = [command for field, command in DETECTOR_INFO_QUERIES]
+		if init:
+			commands.insert(0, "Init")
+		self.clearInputMainSocket()
+		if init:
+			self.clearInputStatusSocket()
+			self.sock_status.sendall("Init\n".encode())
+		self.sock.sendall("".join(command + "\n" for command in commands).encode())
+		values = [self.getAckValue(self.receiveResponse()) for command in commands]
+		if init:
+			data = b""
+			while data.find(b">") == -1:
+				ret = self.sock_status.recv(BUFFER_SIZE)
+				if not ret:
+					raise Xpad_Error("ERROR: Connection closed by server.")
+				data += ret
+			if values.pop(0) != "0" or self.getAckValue(data) != "0":
+				raise Xpad_Error("ERROR: Init failed.")
+		fields = dict((field, value) for (field, command), value in zip(DETECTOR_INFO_QUERIES, values))
+		size = re.findall(r'\d+', fields.pop("imageSize"))
+		if len(size) < 2:
+			raise Xpad_Error("ERROR: Bad image size : " + str(values))
+		self.info = DetectorInfo(imageHeight=int(size[0]), imageWidth=int(size[1]),
+			moduleMask=int(fields.pop("moduleMask")), moduleNumber=int(fields.pop("moduleNumber")), **fields)
+		self.moduleMask = self.info.moduleMask
+		self.detectorModel = self.info.detectorModel
+		self.ImageHeight = self.info.imageHeight
+		self.ImageWidth = self.info.imageWidth
+		return self.info
+
 	def getImageHeight(self):
 		return self.ImageHeight
 		
 	def getImageWidth(self):
 		return self.ImageWidth	
 	
-	def readOneImage(self):	
-		ImageHeight = 0
-
-		ImageSize        = int(struct.unpack('<i', self.sock.recv(4))[0])	
-		self.ImageHeight = int(struct.unpack('<i', self.sock.recv(4))[0])
-		self.ImageWidth  = int(struct.unpack('<i', self.sock.recv(4))[0])
-
-
-		#ABORT DETECTED
-		if ImageSize == 0 :
-			self.sock.send("OK\n".encode())
-			self.receiveResponse()
-			data = self.recvBuffer
-			
-			raise Xpad_Error("Read Image Aborted")
-
-		data = self.receiveImage(ImageSize)
-		self.sock.send("OK\n".encode())			
-		return bytes(data)
+#timeout (s) bounds the wait for the whole frame. On timeout or cancellation the
+#acquisition is aborted and endExposure returns 1.
+	@lockMainSocket
+	def readOneImage(self,timeout=None,cancelToken=None):	
+		return bytes(self.readOneFrame(timeout, cancelToken).data)
+
+#Same as readOneImage but returns a Frame with its index in the exposure and the
+#monotonic times of header arrival and of completion.
+	@lockMainSocket
+	def readOneFrame(self,timeout=None,cancelToken=None):	
+		deadline = deadlineFrom(timeout)
+		header = bytearray(12)
+		phase = "header"
+		ImageSize = 0
+		try:
+			self.receiveInto(memoryview(header), None, deadline, cancelToken)
+			headerTime = time.monotonic()
+			ImageSize, height, width = struct.unpack('<iii', header)
+
+			#ABORT DETECTED
+			if ImageSize == 0 :
+				self.exposureAborted = True
+				self.sock.sendall("OK\n".encode())
+				phase = "response"
+				data = self.receiveResponse(deadline, cancelToken)
+				
+				raise Xpad_Error("Read Image Aborted")
+
+			self.ImageHeight, self.ImageWidth = height, width
+			phase = "payload"
+			data = self.receiveExact(ImageSize, None, deadline, cancelToken)
+		except (Xpad_Timeout, Xpad_Cancelled) as e:
+			self.recoverMainSocket(e, cancelToken, sendAck=True, pending=self.pendingState(e, phase, header, ImageSize))
+			raise
+		frame = Frame(data, self.ImageHeight, self.ImageWidth, self.frameIndex, headerTime, time.monotonic())
+		self.frameIndex += 1
+		self.sock.sendall("OK\n".encode())			
+		if self.metrics is not None:
+			self.metrics.observeFrame(ImageSize)
+		return frame
+
+#Read nbImages frames of the running exposure into one contiguous (nbImages, H, W)
+#int32 array, each frame received directly into its slice (out can be given to reuse
+#an array). The ACK of every frame is sent from here. If headerTimes is a list, the
+#header arrival time of every frame is appended to it. timeout (s) bounds the whole
+#read. On abort the Xpad_Error raised carries the frames already read in e.images.
+	@lockMainSocket
+	def readImages(self,nbImages,timeout=None,cancelToken=None,out=None,headerTimes=None):
+		if np is None:
+			raise Xpad_Error("ERROR: readImages needs numpy.")
+		#checked before anything is read, the exposure stays in a known state
+		if out is not None:
+			if out.ndim != 3 or out.shape[0] < nbImages or out.dtype != np.dtype('<i4') or not out.flags.c_contiguous:
+				raise Xpad_Error("ERROR: out must be a C contiguous (%d, H, W) int32 array." % nbImages)
+			if self.ImageHeight > 0 and self.ImageWidth > 0 and out.shape[1:] != (self.ImageHeight, self.ImageWidth):
+				raise Xpad_Error("ERROR: out frames %s do not match the %d x %d images." % (out.shape[1:], self.ImageHeight, self.ImageWidth))
+		deadline = deadlineFrom(timeout)
+		header = bytearray(12)
+		headerView = memoryview(header)
+		ack = "OK\n".encode()
+		stack = out
+		phase = "header"
+		ImageSize = 0
+		try:
+			for i in range(0, nbImages):
+				phase = "header"
+				self.receiveInto(headerView, None, deadline, cancelToken)
+				if headerTimes is not None:
+					headerTimes.append(time.monotonic())
+				ImageSize, height, width = struct.unpack('<iii', header)
+
+				#ABORT DETECTED
+				if ImageSize == 0 :
+					self.exposureAborted = True
+					self.sock.sendall(ack)
+					phase = "response"
+					self.receiveResponse(deadline, cancelToken)
+					e = Xpad_Error("Read Image Aborted")
+					e.images = stack[:i] if stack is not None else None
+					raise e
+
+				self.ImageHeight, self.ImageWidth = height, width
+				if stack is None:
+					stack = np.empty((nbImages, height, width), dtype='<i4')
+				if ImageSize != stack[i].nbytes:
+					#the frame is still to be read and acknowledged: abort and drain it
+					e = Xpad_Error("ERROR: Unexpected image size %d x %d (%d bytes)." % (height, width, ImageSize))
+					e.images = stack[:i]
+					self.recoverMainSocket(e, cancelToken, sendAck=True, pending=self.pendingState(e, "payload", header, ImageSize))
+					raise e
+				phase = "payload"
+				self.receiveInto(memoryview(stack[i]).cast('B'), None, deadline, cancelToken)
+				self.sock.sendall(ack)
+				self.frameIndex += 1
+				if self.metrics is not None:
+					self.metrics.observeFrame(ImageSize)
+		except (Xpad_Timeout, Xpad_Cancelled) as e:
+			self.recoverMainSocket(e, cancelToken, sendAck=True, pending=self.pendingState(e, phase, header, ImageSize))
+			raise
+		if stack is not None:
+			self.ImageHeight, self.ImageWidth = stack.shape[1], stack.shape[2]
+		return stack
+
+#Complete acquisition into one stack: expected frame count, StartExposure,
+#readImages and endExposure. Burst readout in DETECTOR_BURST mode is a single call.
+	@lockMainSocket
+	def acquireStack(self,timeout=None,cancelToken=None,out=None):
+		nbImages = self.getExpectedFrameCount()
+		self.startExposure()
+		try:
+			stack = self.readImages(nbImages, timeout, cancelToken, out)
+		finally:
+			self.endExposure(timeout)
+		return stack
+
+#Number of frames the server will send for one StartExposure. The acquisition mode is
+#asked to the server, the one set by this client may be outdated.
+	@lockMainSocket
+	def getExpectedFrameCount(self):
+		nb = self.getImageNumber()
+		if self.queryAcquisitionMode() == AcqMode.DETECTOR_BURST:
+			nb = nb * self.getBurstNumber()
+		return nb
+
+#Current acquisition mode of the server (an AcqMode value), raises Xpad_Error when the
+#reply is not a known mode. getAcquisitionMode(val) takes an argument and can not be used.
+	@lockMainSocket
+	def queryAcquisitionMode(self):
+		self.clearInputMainSocket()
+		self.sock.send("GetAcquisitionMode\n".encode())
+		data = self.receiveResponse()
+		mode = str(self.getAckValue(data)).strip()
+		if mode not in [v for k, v in vars(AcqMode).items() if not k.startswith("_")]:
+			raise Xpad_Error("ERROR: Unknown acquisition mode " + repr(mode) + ".")
+		self.acquistionMode = mode
+		return mode
 		
 		
 
+	@lockMainSocket
 	def loadConfigG(self,reg,value):	
 		self.clearInputMainSocket()
 		self.sock.send(("LoadConfigG " + reg + " " + value + "\n").encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 		return self.getAckValue(data)	
 
+	@lockMainSocket
 	def readConfigG(self,reg):	
 		self.clearInputMainSocket()
 		self.sock.send(("ReadConfigG " + reg + "\n").encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 		return self.getAckValue(data)		
 
+	@lockMainSocket
 	def ITHLIncrease(self):	
 		self.clearInputMainSocket()
 		self.sock.send(("ITHLIncrease\n").encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 		if self.getAckValue(data) == "0" :
 			return True
 		else:
 			return False		
 		
+	@lockMainSocket
 	def ITHLDecrease(self):	
 		self.sock.send("ITHLDecrease\n".encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 		if self.getAckValue(data) == "0" :
 			return True
 		else:
 			raise Xpad_Error("ERROR: Command not recognized.")				
 		
+	@lockMainSocket
 	def loadFlatConfigL(self,value):	
 		self.clearInputMainSocket()
 		self.sock.send(("LoadFlatConfigL " + str(value) + "\n").encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 		if self.getAckValue(data) == "0" :
 			return True
 		else:
 			raise Xpad_Error("ERROR: Command not recognized.")		
 	
-	def calibrationOTNPulse(self,otnType):
+	@lockMainSocket
+	def calibrationOTNPulse(self,otnType,timeout=None,cancelToken=None):
 		self.clearInputMainSocket()
 		self.sock.send(("CalibrationOTNPulse " + str(otnType) + "\n").encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.waitResponse(timeout, cancelToken)
 		ret  = int(self.getAckValue(data))
 		if ret == -1:
 			raise Xpad_Error("ERROR => Calibration OTN Pulse")
 		else :	
 			return ret
 
-	def calibrationOTN(self,otnType):
+	@lockMainSocket
+	def calibrationOTN(self,otnType,timeout=None,cancelToken=None):
 		self.clearInputMainSocket()
 		self.sock.send(("CalibrationOTN " + str(otnType) + "\n").encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.waitResponse(timeout, cancelToken)
 		ret  = int(self.getAckValue(data))
 		if ret == -1:
 			raise Xpad_Error("ERROR => Calibration OTN")
 		else :	
 			return ret
 			
-	def calibrationBeam(self,exposureTime, ITHL_max, calibType):
+	@lockMainSocket
+	def calibrationBeam(self,exposureTime, ITHL_max, calibType,timeout=None,cancelToken=None):
 		try:
 			self.clearInputMainSocket()
 			self.sock.send(("CalibrationBEAM " + str(exposureTime) + " " + str(ITHL_max) + " " + str(calibType) + "\n").encode())
-			self.receiveResponse()
-			data = self.recvBuffer
+			data = self.waitResponse(timeout, cancelToken)
 			ret  = int(self.getAckValue(data))
 			if ret == -1:
 				raise Xpad_Error("ERROR => Calibration Beam")
@@ -397,6 +1042,7 @@ class XpadCamera:
 		except Xpad_Error as e:
 			raise e
 
+	@lockMainSocket
 	def setExposeParameters(self):
 		try:
 			cmd = "SetExposureParameters "
@@ -405,8 +1051,7 @@ class XpadCamera:
 			cmd += str(self.outputFormatFile) + " " + str(self.acquistionMode) + " " + str(self.nbStack) + " " + self.outputServerFilePath + "\n"
 			self.clearInputMainSocket()
 			self.sock.send(cmd.encode())
-			self.receiveResponse()
-			data = self.recvBuffer	
+			data = self.receiveResponse()
 			
 			ret =  int(self.getAckValue(data))		
 			if ret == -1:
@@ -416,12 +1061,12 @@ class XpadCamera:
 		except Xpad_Error as e:
 			raise e		
 			
+	@lockMainSocket
 	def setNumbersOfImages(self,nbImages):
 		try:
 			self.clearInputMainSocket()
 			self.sock.send(("SetImageNumber " + str(nbImages) + "\n").encode())
-			self.receiveResponse()
-			data = self.recvBuffer
+			data = self.receiveResponse()
 			if self.getAckValue(data) == "0" :
 				return True
 			else:
@@ -429,24 +1074,43 @@ class XpadCamera:
 		except Xpad_Error as e:
 			raise e	
 
+	@lockMainSocket
 	def setExposureTime(self,usTime):
 		self.clearInputMainSocket()
 		self.sock.send(("SetExposureTime " + str(usTime) + " \n").encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 		if int(self.getAckValue(data)) > -1 :
+			self.expTime = usTime
 			return True
 		else:	
 			raise Xpad_Error("ERROR: Command not recognized.")	
 
 
+#The main socket stays locked from startExposure to endExposure, which must be
+#called by the same thread: other threads cannot slip a command between frames.
+	@lockMainSocket
 	def startExposure(self):
-		self.clearInputMainSocket()
-		self.sock.send("StartExposure\n".encode())
+		self.mainLock.acquire()
+		try:
+			self.exposureAborted = False
+			self.frameIndex = 0
+			self.clearInputMainSocket()
+			self.sock.sendall("StartExposure\n".encode())
+		except:
+			self.mainLock.release()
+			raise
 		
-	def endExposure(self):
+#Returns 0 when the exposure completed, 1 when it was aborted by a timeout or a cancellation.
+	@lockMainSocket
+	def endExposure(self,timeout=None,cancelToken=None):
 		#self.clearInputMainSocket()
-		self.receiveResponse()
+		try:
+			if self.exposureAborted:
+				return 1
+			self.waitResponse(timeout, cancelToken)
+		finally:
+			self.exposureAborted = False
+			self.mainLock.release()
 		return 0
 		#data = self.sock.recv(BUFFER_SIZE)
 		#if data.decode().find(">") == -1:
@@ -490,6 +1154,7 @@ class XpadCamera:
 			raise Xpad_Error("BAD return ACK :",ret)
 
 	
+	@lockMainSocket
 	def getDetectorType(self):	
 		self.clearInputMainSocket()
 		self.sock.send(("GetDetectorType\n").encode())
@@ -500,28 +1165,24 @@ class XpadCamera:
 			data.decode().replace(">","")		
 		return self.getAckValue(data)
 
+	@lockMainSocket
 	def getDetectorModel(self):	
 		self.clearInputMainSocket()
 		self.sock.send(("GetDetectorModel\n").encode())
-		self.receiveResponse()
-		data = self.recvBuffer	
-		return self.getAckValue(data)
+		data = self.receiveResponse()
+		self.detectorModel = self.getAckValue(data)
+		return self.detectorModel
 
 		
-	def loadGlobalConfiguration(self,fileName):
+	@lockMainSocket
+	def loadGlobalConfiguration(self,fileName,progress=None):
 		fName = fileName + ".cfg"
 		if os.path.isfile(fName) :
-			fd = open(fName,'r')
-			buf = fd.read()	
-			fd.close()
 			self.clearInputMainSocket()
-			self.sock.send("LoadConfigGFromFile\n".encode())		
-			
-			self.sock.send(struct.pack('i',len(buf)))
-			self.sock.send(buf.encode())
+			self.sock.sendall("LoadConfigGFromFile\n".encode())
+			self.sendFile(fName,progress)
 
-			self.receiveResponse()
-			data = self.recvBuffer	
+			data = self.receiveResponse()
 			ret = 	int(self.getAckValue(data)) 
 			if(ret == -1):
 				raise Xpad_Error("ERROR: Command not recognized.")
@@ -531,21 +1192,16 @@ class XpadCamera:
 		else :
 			raise Xpad_Error("Calibration File does not exist : " +  fileName)
 			
-	def loadLocalConfiguration(self,fileName):
+	@lockMainSocket
+	def loadLocalConfiguration(self,fileName,progress=None):
 		fName = fileName + ".cfl"		
 		if os.path.isfile(fName) :
-			
-			fd = open(fName,'r')
-			buf = fd.read()	
-			fd.close()
 			self.clearInputMainSocket()
-			self.sock.send("LoadConfigLFromFile\n".encode())			
-			self.sock.send(struct.pack('i',len(buf)))
-			self.sock.send(buf.encode())
+			self.sock.sendall("LoadConfigLFromFile\n".encode())
+			self.sendFile(fName,progress)
 
 			self.sock.recv(BUFFER_SIZE)
-			self.receiveResponse()
-			data = self.recvBuffer
+			data = self.receiveResponse()
 			ret = int(self.getAckValue(data))
 			if( ret == "1"):
 				raise Xpad_Error("ERROR: Command not recognized.")
@@ -554,10 +1210,11 @@ class XpadCamera:
 		else :
 			raise Xpad_Error("Calibration File does not exist" )
 
-	def loadCalibration(self,calibrationName):
+	@lockMainSocket
+	def loadCalibration(self,calibrationName,progress=None):
 			try:
-				if( self.loadGlobalConfiguration(calibrationName) == 0): 
-					self.loadLocalConfiguration(calibrationName) 
+				if( self.loadGlobalConfiguration(calibrationName,progress) == 0): 
+					self.loadLocalConfiguration(calibrationName,progress) 
 			except Xpad_Error as e :
 				raise Xpad_Error(e)
 
@@ -611,37 +1268,39 @@ class XpadCamera:
 			raise Xpad_Error(e)
 		
 	
-	def saveConfigL(self,fileName):
+	def saveConfigL(self,fileName,progress=None):
 
 		nbMod = int(self.getModuleNumber())
+		self.downloadConfigL(fileName + ".cfl",progress)
+		return True
+
+#Download the local configuration of all modules to fName, returns its size in bytes.
+	@lockMainSocket
+	def downloadConfigL(self,fName,progress=None):
 		self.clearInputMainSocket()
-		self.sock.send("ReadConfigL\n".encode())
+		self.sock.sendall("ReadConfigL\n".encode())
 		
-		dataSize = int(struct.unpack('<i', self.sock.recv(4))[0])				
-		fileSize = int(struct.unpack('<i', self.sock.recv(4))[0])
-		buf = self.receiveImage(fileSize)
-		self.sock.send("OK\n".encode())			
-		
-		fd = open(fileName + ".cfl",'w')
-		fd.write(buf.decode())
-		fd.close()		
+		dataSize, fileSize = struct.unpack('<ii', self.receiveExact(8))
+		self.receiveFile(fName, fileSize, progress)
+		self.sock.sendall("OK\n".encode())			
 			
-		self.receiveResponse()
-		data = self.recvBuffer	
+		data = self.receiveResponse()
 		if (int(self.getAckValue(data)) == -1):
-			raise Xpad_Error("ERROR => load Config L File : " + fileName)
+			raise Xpad_Error("ERROR => load Config L File : " + fName)
 		else :
-			return True
+			return fileSize
 
 	
-	def saveCalibration(self,calibrationName):
+	@lockMainSocket
+	def saveCalibration(self,calibrationName,progress=None):
 		try:	
 			if(self.saveConfigG(calibrationName)):
-				self.saveConfigL(calibrationName )
+				self.saveConfigL(calibrationName,progress)
 		except Xpad_Error as e:
 			raise Xpad_Error(e)	
 
 
+	@lockMainSocket
 	def ITHLDecrease(self):	
 		self.sock.send("ITHLDecrease\n".encode())
 		data = self.sock.recv(BUFFER_SIZE)
@@ -654,11 +1313,11 @@ class XpadCamera:
 		else:
 			raise Xpad_Error("ERROR: Command not recognized.")
 
+	@lockMainSocket
 	def getBurstNumber(self):	
 		self.clearInputMainSocket()
 		self.sock.send("GetBurstNumber\n".encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 		return int(self.getAckValue(data))
 	
 
@@ -669,6 +1328,7 @@ class XpadCamera:
 	#Calibrating.
 	#Digital_Test.
 	#Resetting.
+	@lockStatusSocket
 	def getDetectorStatus(self):	
 		self.clearInputStatusSocket()
 		self.sock_status.send("GetDetectorStatus\n".encode())
@@ -683,12 +1343,15 @@ class XpadCamera:
 		
 		try :
 			val = self.getAckValue(data)
+			if self.metrics is not None:
+				self.metrics.setDetectorStatus(val)
 			return val
 		except Exception as e:
 			print(e)
 			return "ERROR STATUS"
 
 
+	@lockStatusSocket
 	def abortCurrentProcess(self):	
 		self.clearInputStatusSocket()
 		self.sock_status.send("AbortCurrentProcess\n".encode())
@@ -699,17 +1362,32 @@ class XpadCamera:
 			data.decode().replace(">","")
 		return True
 
+#Send any query on the status socket and return its ack value. Used to poll
+#information (temperatures, ...) without waiting for the main socket.
+	@lockStatusSocket
+	def statusQuery(self,command):	
+		self.clearInputStatusSocket()
+		self.sock_status.sendall((command + "\n").encode())
+		data = b""
+		while data.find(b">") == -1:
+			ret = self.sock_status.recv(BUFFER_SIZE)
+			if not ret:
+				raise Xpad_Error("ERROR: Connection closed by server.")
+			data += ret
+		return self.getAckValue(data)
+
+	@lockMainSocket
 	def getImageNumber(self):	
 		self.clearInputMainSocket()
 		self.sock.send("GetImageNumber\n".encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 		ret =  int(self.getAckValue(data))		
 		if ret == -1:
 			raise Xpad_Error("ERROR: Command not recognized.")
 		else :	
 			return ret
 
+	@lockMainSocket
 	def getExposureTime(self):	
 		self.sock.send("GetExposureTime\n".encode())
 		data = self.sock.recv(BUFFER_SIZE)
@@ -719,71 +1397,72 @@ class XpadCamera:
 			data.decode().replace(">","")
 		return int(self.getAckValue(data))
 
+	@lockMainSocket
 	def getWaitingTimeBetweenImages(self):	
 		self.clearInputMainSocket()
 		self.sock.send("GetWaitingTimeBetweenImages\n".encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 		ret =  int(self.getAckValue(data))		
 		if ret == -1:
 			raise Xpad_Error("ERROR: Command not recognized.")
 		else :	
 			return ret
 
+	@lockMainSocket
 	def getGeometricalCorrectionFlag(self):	
 		self.clearInputMainSocket()
 		self.sock.send("GetGeometricalCorrectionFlag\n".encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 		ret =  int(self.getAckValue(data))
 		if ret == -1:
 			raise Xpad_Error("ERROR: Command not recognized.")
 		else :	
 			return ret
 
+	@lockMainSocket
 	def getFlatFieldCorrectionFlag(self):	
 		self.clearInputMainSocket()
 		self.sock.send("GetFlatFieldCorrectionFlag\n".encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 		ret =  int(self.getAckValue(data))
 		if ret == -1:
 			raise Xpad_Error("ERROR: Command not recognized.")
 		else :	
 			return ret
 
+	@lockMainSocket
 	def getNoisyPixelCorrectionFlag(self):	
 		self.clearInputMainSocket()
 		self.sock.send("GetNoisyPixelCorrectionFlag\n".encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 		ret =  int(self.getAckValue(data))	
 		if ret == -1:
 			raise Xpad_Error("ERROR: Command not recognized.")
 		else :	
 			return ret
 
+	@lockMainSocket
 	def getDeadPixelCorrectionFlag(self):	
 		self.clearInputMainSocket()
 		self.sock.send("GetDeadPixelCorrectionFlag\n".encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 		return self.getAckValue(data)
 		
+	@lockMainSocket
 	def getImageTransferFlag(self):	
 		self.sock.send("GetImageTransferFlag\n".encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 		return self.getAckValue(data)
 
 
+	@lockMainSocket
 	def getAcquisitionMode(self):	
 		self.clearInputMainSocket()
 		self.sock.send("GetAcquisitionMode\n".encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 		return self.getAckValue(data)
 		
+	@lockMainSocket
 	def getOutputFileFormat(self):	
 		self.sock.send("GetOutputFileFormat\n".encode())
 		data = self.sock.recv(BUFFER_SIZE)
@@ -793,84 +1472,85 @@ class XpadCamera:
 			data.decode().replace(">","")
 		return self.getAckValue(data)
 		
+	@lockMainSocket
 	def getOutputFilePath(self):	
 		self.clearInputMainSocket()
 		self.sock.send("GetOutputFilePath\n".encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 		return self.getAckValue(data)
 		
+	@lockMainSocket
 	def getInputSignal(self):	
 		self.sock.send("GetInputSignal\n".encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 		return self.getAckValue(data)
 
 
+	@lockMainSocket
 	def getOutputSignal(self):	
 		self.clearInputMainSocket()
 		self.sock.send("GetOutputSignal\n".encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 		return self.getAckValue(data)
 
 
+	@lockMainSocket
 	def setOutputSignal(self,val):
 		self.clearInputMainSocket()
 		self.outputSignal = val
 		self.sock.send(("SetOutputSignal " + val + "\n").encode())
-		self.receiveResponse()
-		data = self.recvBuffer	
+		data = self.receiveResponse()
 		if self.getAckValue(data) == "0" :
 			return True
 		else:
 			return False
 
 
+	@lockMainSocket
 	def setInputSignal(self,val):
 		self.clearInputMainSocket()
 		self.inputSignal = val
 		self.sock.send(("SetInputSignal " + val + "\n").encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 		if self.getAckValue(data) == "0" :
 			return True
 		else:
 			return False
 		
+	@lockMainSocket
 	def setOutputFilePath(self,val):
 		self.clearInputMainSocket()
 		self.outputServerFilePath = val
 		self.sock.send(("SetOutputFilePath " + val + "\n").encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 		if self.getAckValue(data) == "0" :
 			return True
 		else:
 			raise Xpad_Error("ERROR: Command not recognized.")
 
+	@lockMainSocket
 	def setOutputFileFormat(self,val):
 		self.clearInputMainSocket()
 		self.outputFormatFile = val
 		self.sock.send(("SetOutputSignal " + val + "\n").encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 		if self.getAckValue(data) == "0" :
 			return True
 		else:
 			raise Xpad_Error("ERROR: Command not recognized.")
 		
+	@lockMainSocket
 	def setAcquisitionMode(self,val):
 		self.clearInputMainSocket()
 		self.acquistionMode = val
 		self.sock.send(("SetAcquisitionMode " + val + " \n").encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 		if int(self.getAckValue(data)) > -1 :
 			return True
 		else:
 			raise Xpad_Error("ERROR: Command not recognized.")
 		
+	@lockMainSocket
 	def setImageTransferFlag(self,val):
 		self.clearInputMainSocket()
 		self.imageTransfertFlag = val
@@ -879,13 +1559,13 @@ class XpadCamera:
 		else:
 			value = "false"
 		self.sock.send(("SetOutputSignal " + value + "\n").encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 		if int (self.getAckValue(data)) > -1 :
 			return True
 		else:
 			raise Xpad_Error("ERROR: Command not recognized.")
 		
+	@lockMainSocket
 	def setDeadPixelFlag(self,val):
 		self.clearInputMainSocket()
 		if(val):
@@ -893,21 +1573,21 @@ class XpadCamera:
 		else:
 			value = "false"
 		self.sock.send(("SetDeadPixelCorrectionFlag " + value + "\n").encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 				
 		if int(self.getAckValue(data)) > -1 :
 			return True
 		else:
 			raise Xpad_Error("ERROR: Command not recognized.")
 		
+	@lockMainSocket
 	def getAcquisitionMode(self,val):
 		self.clearInputMainSocket()
 		self.sock.send(("GetAcquisitionMode " + val + "\n").encode())
-		self.receiveResponse()
-		data = self.recvBuffer	
+		data = self.receiveResponse()
 		return self.getAckValue(data)
 
+	@lockMainSocket
 	def setNoisyPixelFlag(self,val):
 		self.clearInputMainSocket()
 		if(val):
@@ -915,14 +1595,14 @@ class XpadCamera:
 		else:
 			value = "false"		
 		self.sock.send(("SetNoisyPixelCorrectionFlag " + value + "\n").encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 		if int(self.getAckValue(data)) > -1 :
 			return True
 		else:
 			raise Xpad_Error("ERROR: Command not recognized.")
 
 
+	@lockMainSocket
 	def setFlatFieldCorrectionFlag(self,val):
 		self.clearInputMainSocket()
 		self.flatFieldFlag = val
@@ -931,13 +1611,13 @@ class XpadCamera:
 		else:
 			value = "false"
 		self.sock.send(("SetFlatFieldCorrectionFlag " + value + "\n").encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 		if int(self.getAckValue(data)) > -1 :
 			return True
 		else:
 			raise Xpad_Error("ERROR: Command not recognized.")
 
+	@lockMainSocket
 	def setGeometricalCorrectionFlag(self,val):
 		self.clearInputMainSocket()
 		self.geometricalCorrectionFlag = val
@@ -947,19 +1627,18 @@ class XpadCamera:
 			value = "false"
 			
 		self.sock.send(("SetGeometricalCorrectionFlag " + value + "\n").encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 		if int(self.getAckValue(data)) > -1 :
 			return True
 		else:
 			raise Xpad_Error("ERROR: Command not recognized.")
 
+	@lockMainSocket
 	def setWaitingTimeBetweenImage(self,val):
 		self.clearInputMainSocket()
 		self.waitingTime = val
 		self.sock.send(("SetWaitingTimeBetweenImages " + val + "\n").encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 				
 		if int(self.getAckValue(data)) > -1 :
 			return True
@@ -967,12 +1646,12 @@ class XpadCamera:
 			raise Xpad_Error("ERROR: Command not recognized.")
 		
 		
+	@lockMainSocket
 	def setOverFlowTime(self,val):
 		self.clearInputMainSocket()
 		self.overflowTime = val
 		self.sock.send(("SetDeadPixelFlag " + str(val) + "\n").encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 			
 		if int(self.getAckValue(data)) > -1 :
 			return True
@@ -980,17 +1659,18 @@ class XpadCamera:
 			raise Xpad_Error("ERROR: Command not recognized.")
 
 
+	@lockMainSocket
 	def createWhiteImage(self,whiteName):
 		self.clearInputMainSocket()
 		self.sock.send(("CreateWhiteImage " + whiteName + "\n").encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 			
 		if int(self.getAckValue(data)) > -1 :
 			return True
 		else:
 			raise Xpad_Error("ERROR: Command not recognized.")
 
+	@lockMainSocket
 	def deleteWhiteImage(self,whiteName):
 		self.clearInputMainSocket()
 		self.sock.send(("DeleteWhiteImage " + whiteName + "\n").encode())
@@ -1004,11 +1684,11 @@ class XpadCamera:
 			data = data.split(".")
 			return data[0]
 
+	@lockMainSocket
 	def setWhiteImage(self,whiteName):
 		self.clearInputMainSocket()
 		self.sock.send(("SetWhiteImage " + whiteName + "\n").encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 				
 		if int(self.getAckValue(data)) > -1 :
 			return True
@@ -1016,6 +1696,7 @@ class XpadCamera:
 			raise Xpad_Error("ERROR: Command not recognized.")
 
 
+	@lockMainSocket
 	def getWhiteImagesInDir(self):
 		self.clearInputMainSocket()
 		self.sock.send(("GetWhiteImagesInDir\n").encode())
@@ -1027,6 +1708,7 @@ class XpadCamera:
 		else:	
 			return self.getAckValue(data)
 		
+	@lockMainSocket
 	def readDetectorTemperature(self):
 		self.clearInputMainSocket()
 		self.sock.send(("ReadDetectorTemperature\n").encode())
@@ -1034,11 +1716,11 @@ class XpadCamera:
 		return self.getAckValue(data) 
 	
 	
+	@lockMainSocket
 	def readCtnTemperature(self):	
 		self.clearInputMainSocket()
 		self.sock.send(("readCtnTemperature\n").encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 		ret = data.decode()
 		index = 0
 		
@@ -1051,18 +1733,21 @@ class XpadCamera:
 		if(ret.split()[index] == "*"):
 			for i in range(len(ret)):
 				if ret[i] == '"':
-					return ret.split('"')[1]
+					value = ret.split('"')[1]
+					if self.metrics is not None:
+						self.metrics.setTemperatures(dict(("readCtnTemperature." + k, v) for k, v in parseKeyValueList(value).items()))
+					return value
 					
 			return ret.split()[index+1]
 
 		else:
 			raise Xpad_Error("BAD return ACK :",ret)
 		
+	@lockMainSocket
 	def getDetectorInformations(self,registerName):	
 		self.clearInputMainSocket()
 		self.sock.send(("GetDetInformation " + registerName + "\n").encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 		ret = data.decode()
 		index = 0
 		
@@ -1083,23 +1768,23 @@ class XpadCamera:
 			raise Xpad_Error("BAD return ACK :",ret)
 		
 
+	@lockMainSocket
 	def SetDetectorInformations(self,registerName,value):
 		self.clearInputMainSocket()
 		self.sock.send(("SetDetInformation " + registerName + " " + value + "\n").encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 				
 		if int(self.getAckValue(data)) > -1 :
 			return True
 		else:
 			raise Xpad_Error("ERROR: Command not recognized.")
 
+	@lockMainSocket
 	def SetDacHv(self,val):
 		self.clearInputMainSocket()
 		self.overflowTime = val
 		self.sock.send(("SetHvValue " + str(val) + "\n").encode())
-		self.receiveResponse()
-		data = self.recvBuffer
+		data = self.receiveResponse()
 			
 		if int(self.getAckValue(data)) > -1 :
 			self.resetDetector()
@@ -1109,3 +1794,32 @@ class XpadCamera:
 			raise Xpad_Error("ERROR: Command not recognized.")
 			
 
+
+#Measure command latency (GetDetectorStatus round trips on the status socket) and
+#bulk throughput (download of the local configuration, discarded) for one transport.
+#Returns a dictionary, times in seconds and throughput in bytes per second.
+def benchmarkTransport(transport, ip=None, port=None, nbRequests=100, withThroughput=True):
+	camera = XpadCamera(ip, port, transport)
+	try:
+		latency = []
+		for i in range(0, nbRequests):
+			t0 = time.perf_counter()
+			camera.getDetectorStatus()
+			latency.append(time.perf_counter() - t0)
+		latency.sort()
+		result = {
+			"transport"		: getattr(transport, "name", type(transport).__name__),
+			"latency_min"	: latency[0],
+			"latency_median": latency[len(latency) // 2],
+			"latency_max"	: latency[-1],
+			"latency_mean"	: sum(latency) / len(latency),
+		}
+		if withThroughput:
+			t0 = time.perf_counter()
+			size = camera.downloadConfigL(os.devnull)
+			elapsed = time.perf_counter() - t0
+			result["bytes"] = size
+			result["throughput"] = size / elapsed if elapsed > 0 else 0.0
+		return result
+	finally:
+		camera.close()
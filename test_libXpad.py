@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+
+# Compatible : RebirX SERVER
+# Python version	: 3.4.3
+# Requires	 : pytest
+
+#Automated tests against an in-process RebirX server, connected with MemoryTransport
+#(or a local socket for the transport tests):
+#	python -m pytest -q test_libXpad.py
+#The tests of the numpy modules are skipped when numpy is not installed.
+
+import socket
+import struct
+import threading
+
+import pytest
+
+import libXpad
+from libXpad import XpadCamera
+from libXpad import MemoryTransport
+from libXpad import TcpTransport
+from libXpad import UnixTransport
+from libXpad import Xpad_Error
+from libXpad import Xpad_Timeout
+from libXpad import AcqMode
+from libXpad import TriggerMode
+
+
+#Minimal RebirX server: the first connection is the main socket, the second the status
+#socket. An exposure sends nbImages frames (x burst in detector_burst mode) of
+#height x width int32 pixels, each one waiting for its "OK"; after abortAfter frames,
+#or once AbortCurrentProcess is received, it sends the abort header instead. commands
+#lists the main socket commands received, loaded the last file of LoadConfigGFromFile.
+class FakeServer(object):
+	def __init__(self, nbImages=3, height=2, width=4):
+		self.nbImages = nbImages
+		self.height = height
+		self.width = width
+		self.mode = AcqMode.STANDARD
+		self.burst = 1
+		self.delay = 0.0
+		self.abortAfter = None
+		self.abort = threading.Event()
+		self.status = "Idle."
+		self.inputSignal = "internal"
+		self.config = bytes(range(256)) * 64
+		self.loaded = None
+		self.commands = []
+		self.sent = 0
+		self.acks = 0
+		self.unexpected = []
+		self.connections = 0
+		self.lock = threading.Lock()
+
+	def transport(self):
+		return MemoryTransport(self.handler)
+
+	def handler(self, sock):
+		with self.lock:
+			self.connections += 1
+			main = self.connections % 2 == 1
+		try:
+			sock.sendall(b"Welcome\n>")
+			stream = sock.makefile('rb')
+			while True:
+				line = stream.readline()
+				if not line:
+					return
+				command = line.decode().split()
+				if not command:
+					continue
+				if command[0] == "Exit":
+					return
+				if main:
+					self.mainCommand(sock, stream, command)
+				else:
+					self.statusCommand(sock, command)
+		except OSError:
+			pass
+		finally:
+			sock.close()
+
+	def ack(self, sock, value):
+		sock.sendall(("* %s\n>" % value).encode())
+
+	def mainCommand(self, sock, stream, command):
+		name = command[0]
+		self.commands.append(name)
+		if name == "GetImageNumber":
+			self.ack(sock, self.nbImages)
+		elif name == "SetImageNumber":
+			self.nbImages = int(command[1])
+			self.ack(sock, 0)
+		elif name == "GetAcquisitionMode":
+			self.ack(sock, self.mode)
+		elif name == "GetBurstNumber":
+			self.ack(sock, self.burst)
+		elif name == "SetInputSignal":
+			self.inputSignal = command[1]
+			self.ack(sock, 0)
+		elif name in ("SetOutputSignal", "LoadConfigG"):
+			self.ack(sock, 0)
+		elif name == "LoadConfigGFromFile":
+			size = struct.unpack('<i', stream.read(4))[0]
+			self.loaded = stream.read(size)
+			self.ack(sock, 0)
+		elif name == "ReadConfigL":
+			sock.sendall(struct.pack('<ii', len(self.config), len(self.config)) + self.config)
+			self.readAck(stream)
+			self.ack(sock, 0)
+		elif name == "StartExposure":
+			self.exposure(sock, stream)
+		else:
+			self.unexpected.append(name)
+			self.ack(sock, -1)
+
+	def statusCommand(self, sock, command):
+		if command[0] == "AbortCurrentProcess":
+			self.abort.set()
+			self.ack(sock, 0)
+		elif command[0] == "GetDetectorStatus":
+			self.ack(sock, self.status)
+		else:
+			self.ack(sock, -1)
+
+	def exposure(self, sock, stream):
+		self.status = "Acquiring."
+		self.abort.clear()
+		count = self.nbImages * (self.burst if self.mode == AcqMode.DETECTOR_BURST else 1)
+		size = 4 * self.height * self.width
+		for i in range(0, count):
+			self.abort.wait(self.delay)
+			if self.abort.is_set() or i == self.abortAfter:
+				sock.sendall(struct.pack('<iii', 0, self.height, self.width))
+				self.readAck(stream)
+				break
+			sock.sendall(struct.pack('<iii', size, self.height, self.width))
+			sock.sendall(struct.pack('<%di' % (size // 4), *([i + 1] * (size // 4))))
+			self.sent += 1
+			self.readAck(stream)
+		self.status = "Idle."
+		self.ack(sock, 0)
+
+	def readAck(self, stream):
+		line = stream.readline().strip()
+		if line == b"OK":
+			self.acks += 1
+		else:
+			self.unexpected.append(line.decode())
+
+
+@pytest.fixture
+def server():
+	return FakeServer()
+
+@pytest.fixture
+def camera(server):
+	camera = XpadCamera("memory", 0, server.transport())
+	yield camera
+	camera.close()
+
+
+#True when another thread can take the main socket lock, as a second client would
+def lockIsFree(camera):
+	result = []
+	def take():
+		if camera.mainLock.acquire(timeout=1.0):
+			camera.mainLock.release()
+			result.append(True)
+	thread = threading.Thread(target=take)
+	thread.start()
+	thread.join()
+	return bool(result)
+
+
+#user-028: benchmarkTransport measures the status round trip and the ReadConfigL throughput
+def test_benchmarkTransportMemory(server):
+	result = libXpad.benchmarkTransport(server.transport(), nbRequests=10)
+	assert result["transport"] == "memory"
+	assert 0 < result["latency_min"] <= result["latency_median"] <= result["latency_max"]
+	assert result["bytes"] == len(server.config)
+	assert result["throughput"] > 0
+	assert server.acks == 1 and not server.unexpected
+
+#user-028: TcpTransport sets its socket options before connecting
+def test_tcpTransportOptions():
+	listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	listener.bind(("127.0.0.1", 0))
+	listener.listen(1)
+	try:
+		sock = TcpTransport(recvBufferSize=1 << 16).connect("127.0.0.1", listener.getsockname()[1])
+		try:
+			assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY) != 0
+			assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE) != 0
+			assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) >= 1 << 16
+			assert sock.gettimeout() is None
+		finally:
+			sock.close()
+	finally:
+		listener.close()
+
+#user-028: a camera works over a Unix domain socket
+def test_unixTransport(tmp_path):
+	if not hasattr(socket, "AF_UNIX"):
+		pytest.skip("no Unix domain sockets")
+	server = FakeServer()
+	path = str(tmp_path / "xpad.sock")
+	listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	listener.bind(path)
+	listener.listen(2)
+	def accept():
+		for i in range(0, 2):
+			conn, address = listener.accept()
+			thread = threading.Thread(target=server.handler, args=(conn,))
+			thread.daemon = True
+			thread.start()
+	acceptor = threading.Thread(target=accept)
+	acceptor.daemon = True
+	acceptor.start()
+	camera = XpadCamera(None, None, UnixTransport(path))
+	try:
+		assert camera.getImageNumber() == server.nbImages
+	finally:
+		camera.close()
+		listener.close()
+
+#user-045: leaving the with block early aborts the exposure and frees the lock
+def test_triggeredAcquisitionEarlyExit(server, camera):
+	pytest.importorskip("numpy")
+	from xpadTrigger import TriggeredAcquisition
+	server.delay = 0.05
+	with TriggeredAcquisition(camera, 3, firstTriggerTimeout=5, triggerTimeout=5) as acquisition:
+		assert server.inputSignal == TriggerMode.EXTERNAL_MULTI_TRIGGER
+		for group in acquisition.groups():
+			assert group.images.shape == (1, server.height, server.width)
+			break
+	assert lockIsFree(camera)
+	assert server.inputSignal == TriggerMode.INTERNAL
+	assert camera.getImageNumber() == 3
+	assert not server.unexpected
+
+#user-045: a server abort inside groups() still ends the exposure on leaving the block
+def test_triggeredAcquisitionServerAbort(server, camera):
+	pytest.importorskip("numpy")
+	from xpadTrigger import TriggeredAcquisition
+	server.abortAfter = 1
+	acquisition = TriggeredAcquisition(camera, 3, firstTriggerTimeout=5, triggerTimeout=5)
+	with pytest.raises(Xpad_Error):
+		with acquisition:
+			for group in acquisition.groups():
+				pass
+	assert lockIsFree(camera)
+	assert acquisition.close() == 0
+
+#user-045: only the arming thread may close
+def test_triggeredAcquisitionOwner(server, camera):
+	pytest.importorskip("numpy")
+	from xpadTrigger import TriggeredAcquisition
+	acquisition = TriggeredAcquisition(camera, 1, firstTriggerTimeout=5)
+	acquisition.arm()
+	errors = []
+	def closeElsewhere():
+		try:
+			acquisition.close()
+		except Xpad_Error as e:
+			errors.append(e)
+	thread = threading.Thread(target=closeElsewhere)
+	thread.start()
+	thread.join()
+	assert errors
+	assert acquisition.close() == 1
+	assert lockIsFree(camera)
+
+#user-030: an abort header sets exposureAborted, endExposure returns 1 and releases the lock
+def test_serverAbortReleasesLock(server, camera):
+	server.abortAfter = 1
+	camera.startExposure()
+	camera.readOneFrame(5)
+	with pytest.raises(Xpad_Error) as info:
+		camera.readOneFrame(5)
+	assert "Aborted" in str(info.value)
+	assert camera.exposureAborted
+	assert camera.endExposure(5) == 1
+	assert lockIsFree(camera)
+	assert camera.getImageNumber() == server.nbImages
+	assert server.acks == 2 and not server.unexpected
+
+#user-030: a timeout recovery sends one "OK" per message drained, none per poll tick
+def test_timeoutRecoveryAcksEachFrame(server, camera):
+	server.nbImages = 5
+	server.delay = 0.3
+	camera.startExposure()
+	with pytest.raises(Xpad_Timeout) as info:
+		camera.readOneFrame(0.05)
+	assert info.value.abortLatency is not None
+	assert camera.endExposure(5) == 1
+	assert lockIsFree(camera)
+	#the frames read before the abort and the abort header, each acknowledged once
+	assert server.acks == server.sent + 1
+	assert camera.getImageNumber() == 5
+	assert not server.unexpected
+
+#user-030: a recovery in the middle of a frame reads the rest of it before the ACK
+def test_recoveryInsideFrame(server, camera):
+	server.height, server.width = 64, 64
+	server.delay = 0.2
+	camera.startExposure()
+	camera.readOneFrame(5)
+	camera.receiveExact(100)
+	camera.recoverMainSocket(None, None, sendAck=True, pending=(b"", 12 + 4 * 64 * 64 - 100, False))
+	assert camera.endExposure(5) == 1
+	assert server.acks == server.sent + 1
+	assert camera.getImageNumber() == server.nbImages
+	assert not server.unexpected
+
+#user-032: the frame count follows the mode of the server, not the client cache
+def test_expectedFrameCountBurst(server, camera):
+	server.nbImages = 2
+	server.burst = 3
+	server.mode = AcqMode.DETECTOR_BURST
+	assert camera.getExpectedFrameCount() == 6
+	server.mode = AcqMode.STANDARD
+	assert camera.getExpectedFrameCount() == 2
+	server.mode = "unknown_mode"
+	with pytest.raises(Xpad_Error):
+		camera.getExpectedFrameCount()
+
+#user-027: a server abort during a threshold step ends the exposure and frees the lock
+def test_thresholdScanAbortReleasesLock(server, camera):
+	pytest.importorskip("numpy")
+	from xpadThresholdScan import ThresholdScan
+	server.abortAfter = 1
+	scan = ThresholdScan(camera, [10, 20], nbImages=2)
+	with pytest.raises(Xpad_Error):
+		scan.run()
+	assert lockIsFree(camera)
+	assert not camera.exposureAborted
+
+#user-047: the index of dense and sparse records survives a write / read
+def test_sparseRoundTrip(tmp_path):
+	np = pytest.importorskip("numpy")
+	from xpadSparse import SparseWriter
+	from xpadSparse import SparseReader
+	from xpadSparse import SparseFrame
+	dense = np.arange(1, 33, dtype='<i4').reshape(4, 8)
+	sparse = np.zeros((4, 8), dtype='<i4')
+	sparse[1, 2] = 300
+	sparse[3, 7] = 5
+	fileName = str(tmp_path / "frames.bin")
+	writer = SparseWriter(fileName)
+	writer.write(libXpad.Frame(dense.tobytes(), 4, 8, 5, None, None))
+	writer.write(libXpad.Frame(sparse.tobytes(), 4, 8, 9, None, None))
+	writer.write(sparse)
+	writer.close()
+	assert writer.stats()["sparse"] == 2
+	reader = SparseReader(fileName)
+	frames = list(reader)
+	reader.close()
+	assert [frame.index for frame in frames] == [5, 9, 2]
+	assert isinstance(frames[0], libXpad.Frame) and isinstance(frames[1], SparseFrame)
+	assert np.array_equal(frames[0].toArray(), dense)
+	assert np.array_equal(frames[1].toDense(), sparse)
+	assert frames[1].counts.dtype == np.dtype('<u2')
+	reader = SparseReader(fileName, dense=True)
+	assert [frame.index for frame in reader] == [5, 9, 2]
+	reader.close()
+
+#user-041: an out array of the wrong image size aborts and drains the exposure, the
+#connection stays usable
+def test_readImagesOutMismatch(server, camera):
+	np = pytest.importorskip("numpy")
+	camera.startExposure()
+	try:
+		with pytest.raises(Xpad_Error):
+			camera.readImages(3, timeout=5, out=np.empty((3, server.height + 1, server.width), dtype='<i4'))
+	finally:
+		assert camera.endExposure(5) == 1
+	assert lockIsFree(camera)
+	assert camera.getImageNumber() == 3
+	assert not server.unexpected
+	#the image size is known now: the check happens before anything is read
+	camera.startExposure()
+	try:
+		with pytest.raises(Xpad_Error):
+			camera.readImages(3, timeout=5, out=np.empty((3, server.height + 1, server.width), dtype='<i4'))
+		images = camera.readImages(3, timeout=5, out=np.empty((3, server.height, server.width), dtype='<i4'))
+	finally:
+		assert camera.endExposure(5) == 0
+	assert [int(image[0, 0]) for image in images] == [1, 2, 3]
+	assert not server.unexpected
+
+#user-048: without a 16 bits frame counter the ceiling is the count rate, in a 16 bits
+#mode a frame at the counter limit divides the time
+def test_exposureControllerModes(server, camera):
+	np = pytest.importorskip("numpy")
+	from xpadExposure import ExposureController
+	controller = ExposureController(camera, minTime=1000, maxTime=2000000)
+	assert controller.frameMax is None
+	assert controller.update(np.full((server.height, server.width), 1000, dtype='<i4')) == 2000000
+	assert controller.saturated == 0
+	server.mode = AcqMode.STACKING_16BITS
+	controller = ExposureController(camera, minTime=1000, maxTime=2000000)
+	assert controller.frameMax == 0xffff
+	assert controller.update(np.full((server.height, server.width), 0xffff, dtype='<i4')) == camera.expTime // 4
+	assert controller.saturated == 1
+	assert server.commands.count("GetAcquisitionMode") == 2
+
+#user-040: a socket error on the status connection is counted, the sampler goes on
+def test_telemetrySocketError(camera, monkeypatch):
+	from xpadTelemetry import TelemetrySampler
+	def statusQuery(command):
+		raise ConnectionResetError("status connection lost")
+	monkeypatch.setattr(camera, "statusQuery", statusQuery)
+	sampler = TelemetrySampler(camera)
+	assert sampler.sample() == {}
+	assert sampler.errors == len(sampler.commands) + len(sampler.informations)
+	assert sampler.latest()[1] == {}
+
+#Socket without sendfile, as before Python 3.5
+class NoSendfileSocket(object):
+	def __init__(self, sock):
+		self.sock = sock
+
+	def __getattr__(self, name):
+		if name == "sendfile":
+			raise AttributeError(name)
+		return getattr(self.sock, name)
+
+#user-026: a file is streamed with socket.sendfile, or by chunks without it
+@pytest.mark.parametrize("withSendfile", [True, False])
+def test_sendFile(server, camera, tmp_path, monkeypatch, withSendfile):
+	monkeypatch.setattr(libXpad, "CHUNK_SIZE", 1000)
+	if not withSendfile:
+		camera.sock = NoSendfileSocket(camera.sock)
+	data = bytes(range(256)) * 20
+	(tmp_path / "config.cfg").write_bytes(data)
+	progress = []
+	assert camera.loadGlobalConfiguration(str(tmp_path / "config"), lambda sent, total: progress.append(sent)) == 0
+	assert server.loaded == data
+	assert progress[-1] == len(data) and len(progress) == 6
+	assert camera.getImageNumber() == 3
+
+#user-035: fsync batches are counted only when they hold files
+@pytest.mark.parametrize("nbFrames, nbFsync", [(4, 2), (5, 3), (0, 0)])
+def test_frameWriterFsync(tmp_path, nbFrames, nbFsync):
+	from xpadWriter import FrameWriter
+	writer = FrameWriter(str(tmp_path), nbThreads=1, fsyncInterval=2)
+	for i in range(0, nbFrames):
+		writer.write(libXpad.Frame(bytes(8), 1, 2, i, 0.0, 0.0))
+	writer.close()
+	assert writer.stats()["fsync"] == nbFsync
+	assert writer.stats()["written"] == nbFrames
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+
+# Compatible : RebirX SERVER
+# Python version	: 3.4.3
+
+#Non interactive acquisition:
+#	xpadAcquire.py 192.168.0.15 --exposure 1000 --images 1000 --format stack -o run01
+#connects, applies the acquisition parameters, streams the frames to the output and
+#prints a throughput and latency summary. The exit code is 1 if frames are missing,
+#130 when Ctrl-C aborted the exposure.
+
+import argparse
+import os
+import signal
+import struct
+import sys
+import time
+
+from libXpad import XpadCamera
+from libXpad import Xpad_Error
+from libXpad import Xpad_Cancelled
+from libXpad import CancelToken
+from libXpad import AcqMode
+from libXpad import AcquisitionStats
+from libXpad import TcpTransport
+from libXpad import UnixTransport
+from xpadWriter import FrameWriter
+
+FORMATS = ("raw", "stack", "dat", "sparse", "none")
+
+
+#One .bin file per frame, raw int32 pixels
+class RawOutput(object):
+	def __init__(self, directory, prefix):
+		self.directory = directory
+		self.prefix = prefix
+
+	def write(self, frame):
+		name = os.path.join(self.directory, "%s%06d.bin" % (self.prefix, frame.index))
+		with open(name, 'wb') as fd:
+			fd.write(frame.data)
+
+	def close(self):
+		pass
+
+#All frames appended to a single .bin file, the fastest to write
+class StackOutput(object):
+	def __init__(self, directory, prefix):
+		self.fd = open(os.path.join(directory, prefix + "_stack.bin"), 'wb')
+
+	def write(self, frame):
+		self.fd.write(frame.data)
+
+	def close(self):
+		self.fd.close()
+
+#One text .dat file per frame, same layout as testXpadLib.writeDatFile
+class DatOutput(RawOutput):
+	def write(self, frame):
+		name = os.path.join(self.directory, "%s%06d.dat" % (self.prefix, frame.index))
+		values = struct.unpack('<%di' % (frame.height * frame.width), frame.data)
+		with open(name, 'w') as fd:
+			for h in range(0, frame.height):
+				row = values[h * frame.width:(h + 1) * frame.width]
+				fd.write(" ".join(str(v) for v in row))
+				fd.write(" \n")
+
+class NoOutput(object):
+	def write(self, frame):
+		pass
+
+	def close(self):
+		pass
+
+
+def openOutput(fmt, directory, prefix, nbThreads=0, fsyncInterval=0):
+	if fmt == "none":
+		return NoOutput()
+	if not os.path.exists(directory):
+		os.makedirs(directory)
+	if fmt == "raw":
+		if nbThreads > 0:
+			return FrameWriter(directory, prefix, nbThreads, fsyncInterval)
+		return RawOutput(directory, prefix)
+	if fmt == "stack":
+		return StackOutput(directory, prefix)
+	if fmt == "sparse":
+		#needs numpy, imported only for this format
+		from xpadSparse import SparseWriter
+		return SparseWriter(os.path.join(directory, prefix + "_sparse.bin"))
+	return DatOutput(directory, prefix)
+
+
+#Ctrl-C cancels cancelToken instead of raising KeyboardInterrupt, so the read loop
+#stops between frames and the exposure is aborted cleanly; a second Ctrl-C raises.
+#Returns the previous handler, None when not called from the main thread.
+def cancelOnInterrupt(cancelToken):
+	def interrupt(signum, frame):
+		signal.signal(signal.SIGINT, signal.default_int_handler)
+		cancelToken.cancel()
+	try:
+		return signal.signal(signal.SIGINT, interrupt)
+	except ValueError:
+		return None
+
+
+def parseArguments(argv):
+	parser = argparse.ArgumentParser(description="Headless XPAD acquisition")
+	parser.add_argument("host", help="RebirX server address")
+	parser.add_argument("-p", "--port", type=int, default=3456)
+	parser.add_argument("--unix", metavar="PATH", help="connect through a Unix domain socket instead of TCP")
+	parser.add_argument("--recv-buffer", type=int, default=None, help="SO_RCVBUF size in bytes")
+	parser.add_argument("-e", "--exposure", type=int, default=None, help="exposure time in us")
+	parser.add_argument("-n", "--images", type=int, default=None, help="number of images")
+	parser.add_argument("-m", "--mode", default=None,
+		choices=[v for k, v in sorted(vars(AcqMode).items()) if not k.startswith("_")])
+	#corrections are sent only when asked, the server settings are kept otherwise
+	parser.add_argument("--geometrical-correction", dest="geometrical_correction", action="store_true", default=None)
+	parser.add_argument("--no-geometrical-correction", dest="geometrical_correction", action="store_false")
+	parser.add_argument("--flat-field", dest="flat_field", action="store_true", default=None)
+	parser.add_argument("--no-flat-field", dest="flat_field", action="store_false")
+	parser.add_argument("--no-init", action="store_true", help="skip the Init command")
+	parser.add_argument("-f", "--format", choices=FORMATS, default="stack")
+	parser.add_argument("-o", "--output", default="Images", help="output directory")
+	parser.add_argument("--prefix", default="frame")
+	parser.add_argument("--writer-threads", type=int, default=4, help="threads writing raw files, 0 to write in the read loop")
+	parser.add_argument("--fsync-interval", type=int, default=0, help="fsync raw files by batches of N frames, 0 to disable")
+	parser.add_argument("-t", "--timeout", type=float, default=None, help="maximum wait for one frame in s")
+	return parser.parse_args(argv)
+
+
+def printSummary(summary, firstFrameLatency, setupTime):
+	def ms(value):
+		return "-" if value is None else "%.3f ms" % (value * 1000)
+	print("frames          : %d / %s" % (summary["frames"], summary["expected"]))
+	if summary["missing"]:
+		print("missing frames  : %d" % summary["missing"])
+	print("setup time      : %s" % ms(setupTime))
+	print("first frame     : %s" % ms(firstFrameLatency))
+	if summary["frame_rate"]:
+		print("frame rate      : %.1f Hz" % summary["frame_rate"])
+	if summary["throughput"]:
+		print("throughput      : %.1f MB/s" % (summary["throughput"] / 1e6))
+	print("interval median : %s  p99 : %s  max : %s" % (ms(summary["interval_median"]), ms(summary["interval_p99"]), ms(summary["interval_max"])))
+	print("jitter p50      : %s  p90 : %s  p99 : %s" % (ms(summary["jitter_p50"]), ms(summary["jitter_p90"]), ms(summary["jitter_p99"])))
+	print("transfer median : %s" % ms(summary["transfer_p50"]))
+	for index, interval in summary["gaps"]:
+		print("gap before frame %d : %s" % (index, ms(interval)))
+
+
+def main(argv=None):
+	args = parseArguments(argv)
+	if args.unix:
+		transport = UnixTransport(args.unix, recvBufferSize=args.recv_buffer)
+	else:
+		transport = TcpTransport(recvBufferSize=args.recv_buffer)
+
+	t0 = time.monotonic()
+	try:
+		xpad = XpadCamera(args.host, args.port, transport)
+	except (OSError, Xpad_Error) as e:
+		print("Can not connect to the server %s:%d : %s" % (args.host, args.port, e), file=sys.stderr)
+		return 2
+
+	output = None
+	try:
+		if not args.no_init:
+			xpad.init()
+		if args.mode is not None:
+			xpad.setAcquisitionMode(args.mode)
+		if args.exposure is not None:
+			xpad.setExposureTime(args.exposure)
+		if args.images is not None:
+			xpad.setNumbersOfImages(args.images)
+		if args.geometrical_correction is not None:
+			xpad.setGeometricalCorrectionFlag(args.geometrical_correction)
+		if args.flat_field is not None:
+			xpad.setFlatFieldCorrectionFlag(args.flat_field)
+		expected = xpad.getExpectedFrameCount()
+
+		output = openOutput(args.format, args.output, args.prefix, args.writer_threads, args.fsync_interval)
+		stats = AcquisitionStats(expected)
+		setupTime = time.monotonic() - t0
+
+		startTime = time.monotonic()
+		xpad.startExposure()
+		firstFrameLatency = None
+		interrupted = False
+		cancelToken = CancelToken()
+		previousHandler = cancelOnInterrupt(cancelToken)
+		try:
+			for i in range(0, expected):
+				frame = xpad.readOneFrame(args.timeout, cancelToken)
+				if firstFrameLatency is None:
+					firstFrameLatency = frame.headerTime - startTime
+				stats.add(frame)
+				output.write(frame)
+		except Xpad_Cancelled:
+			#readOneFrame already aborted the exposure and waited for Idle
+			interrupted = True
+			print("Interrupted, exposure aborted", file=sys.stderr)
+		except Xpad_Error as e:
+			print(e, file=sys.stderr)
+		except KeyboardInterrupt:
+			#no handler outside the main thread: stop the detector as abortAndWaitIdle
+			#does, acknowledging the frames still sent so that the server reaches Idle
+			interrupted = True
+			print("Interrupted, aborting the exposure", file=sys.stderr)
+			xpad.recoverMainSocket(None, None, sendAck=True)
+		finally:
+			if previousHandler is not None:
+				signal.signal(signal.SIGINT, previousHandler)
+		ret = xpad.endExposure(args.timeout)
+		if ret == 1:
+			print("Exposure Aborted", file=sys.stderr)
+
+		summary = stats.summary()
+		printSummary(summary, firstFrameLatency, setupTime)
+		if isinstance(output, FrameWriter):
+			output.close()
+			writer = output.stats()
+			output = None
+			#no latency when no frame was written
+			if writer["latency_p50"] is not None:
+				print("write latency   : p50 %.3f ms  p99 %.3f ms  (%d fsync)" % (writer["latency_p50"] * 1000, writer["latency_p99"] * 1000, writer["fsync"]))
+		if interrupted:
+			return 130
+		return 1 if summary["missing"] else 0
+	except Xpad_Error as e:
+		print(e, file=sys.stderr)
+		return 1
+	finally:
+		if output is not None:
+			output.close()
+		xpad.close()
+
+
+if __name__ == "__main__":
+	sys.exit(main())
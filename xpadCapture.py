@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+# Compatible : RebirX SERVER
+# Python version	: 3.4.3
+
+import socket
+import struct
+import threading
+import time
+
+CAPTURE_MAGIC = b"XPADCAP1"
+#time since the start of the recording (s), channel, direction, payload length
+RECORD_HEADER = struct.Struct('<dBBI')
+
+#Channels, in the order XpadCamera opens its connections
+MAIN_CHANNEL   = 0
+STATUS_CHANNEL = 1
+
+#Directions, seen from the client
+SENT     = 0
+RECEIVED = 1
+
+
+#Records every byte sent and received on the sockets of an XpadCamera:
+#	camera = XpadCamera(ip, port, recorder=SessionRecorder("session.cap"))
+#The capture file is a magic string followed by one RECORD_HEADER and its payload
+#per socket call.
+class SessionRecorder(object):
+	def __init__(self, fileName):
+		self.fd = open(fileName, 'wb')
+		self.fd.write(CAPTURE_MAGIC)
+		self.lock = threading.Lock()
+		self.t0 = time.monotonic()
+
+	def wrap(self, sock, channel):
+		return RecordingSocket(sock, self, channel)
+
+	def record(self, channel, direction, payload):
+		if not payload:
+			return
+		with self.lock:
+			self.fd.write(RECORD_HEADER.pack(time.monotonic() - self.t0, channel, direction, len(payload)))
+			self.fd.write(payload)
+
+	def close(self):
+		with self.lock:
+			self.fd.close()
+
+
+#Socket proxy logging the data of every send and receive call to a SessionRecorder.
+#Other attributes are forwarded to the real socket.
+class RecordingSocket(object):
+	def __init__(self, sock, recorder, channel):
+		self.sock = sock
+		self.recorder = recorder
+		self.channel = channel
+
+	def __getattr__(self, name):
+		return getattr(self.sock, name)
+
+	def fileno(self):
+		return self.sock.fileno()
+
+	def send(self, data, *args):
+		nb = self.sock.send(data, *args)
+		self.recorder.record(self.channel, SENT, bytes(memoryview(data)[:nb]))
+		return nb
+
+	def sendall(self, data, *args):
+		self.sock.sendall(data, *args)
+		self.recorder.record(self.channel, SENT, bytes(data))
+
+	def recv(self, size, *args):
+		data = self.sock.recv(size, *args)
+		self.recorder.record(self.channel, RECEIVED, data)
+		return data
+
+	def recv_into(self, buf, nbytes=0, *args):
+		nb = self.sock.recv_into(buf, nbytes, *args)
+		self.recorder.record(self.channel, RECEIVED, bytes(memoryview(buf)[:nb]))
+		return nb
+
+	#zero-copy sendfile is given up while recording: the data must be seen to be logged
+	def sendfile(self, file, offset=0, count=None):
+		file.seek(offset)
+		sent = 0
+		while count is None or sent < count:
+			chunk = file.read(65536 if count is None else min(65536, count - sent))
+			if not chunk:
+				break
+			self.sendall(chunk)
+			sent += len(chunk)
+		file.seek(offset + sent)
+		return sent
+
+
+#Yield (time, channel, direction, payload) for every record of a capture file
+def readCapture(fileName, channel=None):
+	with open(fileName, 'rb') as fd:
+		if fd.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+			raise ValueError("Not an Xpad capture file : " + fileName)
+		while True:
+			header = fd.read(RECORD_HEADER.size)
+			if len(header) < RECORD_HEADER.size:
+				return
+			t, chan, direction, length = RECORD_HEADER.unpack(header)
+			if channel is None or chan == channel:
+				yield t, chan, direction, fd.read(length)
+			else:
+				fd.seek(length, 1)
+
+
+#Serve a capture back to a client. The first accepted connection replays the main
+#channel and the second the status channel. Bytes the client received are sent back,
+#bytes it sent are read and discarded, so the client must issue the same traffic as
+#during the recording. speed=None replays as fast as possible, 1.0 at the original
+#pace, 2.0 twice as fast, ...
+#Part of the client code relies on message boundaries (one recv call per message).
+#When replaying as fast as possible, two server messages that were recorded more
+#than messageGap apart are still separated by a pause of messageGap so that the
+#client does not see them merged.
+class ReplayServer(object):
+	def __init__(self, fileName, port=0, host="127.0.0.1", speed=None, messageGap=0.002):
+		self.fileName = fileName
+		self.speed = speed
+		self.messageGap = messageGap
+		self.srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		self.srv.bind((host, port))
+		self.srv.listen(2)
+		self.port = self.srv.getsockname()[1]
+		self.threads = []
+		self.errors = []
+
+	def start(self):
+		thread = threading.Thread(target=self.serve)
+		thread.daemon = True
+		thread.start()
+		return self
+
+	def serve(self):
+		for channel in (MAIN_CHANNEL, STATUS_CHANNEL):
+			conn, address = self.srv.accept()
+			conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+			thread = threading.Thread(target=self.replayChannel, args=(conn, channel))
+			thread.daemon = True
+			thread.start()
+			self.threads.append(thread)
+		self.srv.close()
+
+	def replayChannel(self, conn, channel):
+		try:
+			start = None
+			lastReceived = None
+			for t, chan, direction, payload in readCapture(self.fileName, channel):
+				if direction == RECEIVED:
+					if self.speed:
+						if start is None:
+							start = time.monotonic() - t / self.speed
+						delay = start + t / self.speed - time.monotonic()
+						if delay > 0:
+							time.sleep(delay)
+					elif lastReceived is not None and t - lastReceived > self.messageGap:
+						time.sleep(self.messageGap)
+					conn.sendall(payload)
+					lastReceived = t
+				else:
+					lastReceived = None
+					expected = len(payload)
+					while expected > 0:
+						data = conn.recv(min(expected, 65536))
+						if not data:
+							return
+						expected -= len(data)
+			#let the client close first so it can read everything
+			while conn.recv(65536):
+				pass
+		except Exception as e:
+			self.errors.append(e)
+		finally:
+			conn.close()
+
+	def join(self, timeout=None):
+		for thread in self.threads:
+			thread.join(timeout)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+# Compatible : RebirX SERVER
+# Python version	: 3.4.3
+# Requires	 : numpy
+
+import os
+
+import numpy as np
+
+from libXpad import Xpad_Error
+from xpadLayout import cachedLayout
+from xpadLayout import DetectorLayout
+from xpadMask import toImage
+
+
+#The DigitalTest pattern is written by the detector firmware and is not specified by
+#the server protocol, so the expected frame is not computed here: it is a frame
+#recorded once with recordReference on a detector known to be good (same model,
+#module mask and server version) and saved to a .npy file.
+def recordReference(camera, fileName, mode="gradient", timeout=None):
+	image = toImage(camera.runDigitalTest(mode, timeout))
+	np.save(fileName, image)
+	return image
+
+#Reference frame from an array or from a file of recordReference
+def loadReference(reference):
+	if reference is None:
+		raise Xpad_Error("ERROR: DigitalTest needs a reference frame, see recordReference.")
+	if isinstance(reference, np.ndarray):
+		return reference
+	if not os.path.isfile(reference):
+		raise Xpad_Error("ERROR: DigitalTest reference does not exist : " + reference)
+	return np.load(reference)
+
+
+class DigitalTestReport(object):
+	def __init__(self, mode, mismatches, chipMismatches):
+		self.mode = mode
+		self.mismatches = mismatches
+		self.chipMismatches = chipMismatches
+		self.passed = all(nb == 0 for nb in mismatches.values())
+
+	def __str__(self):
+		lines = ["DigitalTest %s : %s" % (self.mode, "PASS" if self.passed else "FAIL")]
+		for module in sorted(self.mismatches):
+			lines.append("  module %d : %d bad pixels %s" % (module, self.mismatches[module], self.chipMismatches[module]))
+		return "\n".join(lines)
+
+
+#Compare a DigitalTest frame with the reference frame (array or file name) and count
+#the wrong pixels of every module and chip, with whole-frame array operations.
+#moduleMask is the module mask of the detector or its xpadLayout.DetectorLayout.
+def analyzeDigitalTest(frame, mode, moduleMask, reference=None):
+	layout = moduleMask
+	if not isinstance(layout, DetectorLayout):
+		layout = DetectorLayout("XPAD", moduleMask, toImage(frame).shape[1])
+	expected = loadReference(reference)
+	if expected.shape != layout.shape:
+		raise Xpad_Error("ERROR: DigitalTest reference %s does not match the frame %s." % (expected.shape, layout.shape))
+	wrong = layout.image(frame) != expected
+	perChip = layout.chips(wrong).sum(axis=(1, 3))
+	mismatches = dict((module, int(perChip[k].sum())) for k, module in enumerate(layout.moduleNumbers))
+	chipMismatches = dict((module, [int(v) for v in perChip[k]]) for k, module in enumerate(layout.moduleNumbers))
+	return DigitalTestReport(mode, mismatches, chipMismatches)
+
+
+#Health check: the DigitalTest exchange is the only command sent to the camera, then
+#the frame is analyzed. Without moduleMask (a mask or a DetectorLayout) the layout
+#comes from camera.info (XpadCamera.getDetectorInfo, read beforehand); the
+#geometrical correction must already be off. reference is the recordReference frame
+#of mode, loaded before anything is sent.
+def runDigitalTest(camera, mode="gradient", moduleMask=None, reference=None, timeout=None):
+	reference = loadReference(reference)
+	info = camera.info
+	if moduleMask is None and info is None:
+		raise Xpad_Error("ERROR: DigitalTest needs moduleMask or the detector information (getDetectorInfo).")
+	frame = camera.runDigitalTest(mode, timeout)
+	if moduleMask is None:
+		moduleMask = cachedLayout(info.detectorModel, info.moduleMask, frame.width)
+	return analyzeDigitalTest(frame, mode, moduleMask, reference)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+# Compatible : RebirX SERVER
+# Python version	: 3.4.3
+# Requires	 : numpy
+
+import numpy as np
+
+from libXpad import Xpad_Error
+from libXpad import AcqMode
+from xpadMask import toImage
+
+#The pixel counter is 12 bits, the server reads it every overflowTime us and adds it
+#to the frame counter, so a pixel can count at most PIXEL_COUNTER_MAX per overflowTime
+PIXEL_COUNTER_MAX = 4095
+#Frame counters that saturate. In the 32 bits modes the overflow readout keeps the
+#frame counter far from its limit: only the count rate is bounded there.
+FRAME_COUNTER_MAX = {
+	AcqMode.STACKING_16BITS		: 0xffff,
+	AcqMode.SINGLE_BUNCH_16BITS	: 0xffff,
+}
+
+
+#Highest count a frame can hold in acquisitionMode (countLimit when given, None when
+#only the rate is bounded), and highest count rate a pixel can take (counts per us)
+#with overflowTime
+def countLimits(acquisitionMode, overflowTime, countLimit=None):
+	if countLimit is None:
+		countLimit = FRAME_COUNTER_MAX.get(acquisitionMode)
+	return countLimit, float(PIXEL_COUNTER_MAX) / overflowTime
+
+
+#Choose the exposure time of the next frames from the counts of the last ones.
+#The level of a frame is its percentile-th count (np.partition, no full sort) over the
+#unmasked pixels. The next exposure brings that level to target x the saturation
+#ceiling: the 16 bits frame counter of the acquisition mode read from the server (or
+#countLimit), and in the other modes the most a pixel can count in the exposure at the
+#12 bits counter rate, rateMax x expTime. With roi ((row0, row1, col0, col1)) and
+#roiTarget it also aims at roiTarget counts in the roi, without going past the
+#saturation bound. A frame without counts (or without unmasked pixel) gives no rate
+#and keeps the exposure time.
+#A frame with pixels at the counter limit is saturated and the time divided by
+#maxStep; pixels at the 12 bits counter rate set rateLimited and keep the time.
+#Changes are limited to a factor maxStep, clamped to [minTime, maxTime] us, and
+#ignored when below deadband (relative).
+#update(frame) only computes; apply() sends SetExposureTime, one round trip, and
+#must be called between exposures or bursts, never while frames are being read.
+class ExposureController(object):
+	def __init__(self, camera, minTime, maxTime, target=0.5, percentile=99.9, mask=None, roi=None, roiTarget=None, maxStep=4.0, deadband=0.1, countLimit=None):
+		self.camera = camera
+		self.minTime = minTime
+		self.maxTime = maxTime
+		self.target = target
+		self.percentile = percentile
+		self.roi = roi
+		self.roiTarget = roiTarget
+		self.maxStep = maxStep
+		self.deadband = deadband
+		self.validIndices = None
+		if mask is not None:
+			self.validIndices = np.flatnonzero(~np.asarray(getattr(mask, "mask", mask), dtype=bool))
+		self.frameMax, self.rateMax = countLimits(camera.queryAcquisitionMode(), camera.overflowTime, countLimit)
+		self.expTime = camera.expTime
+		self.nextTime = camera.expTime
+		self.saturated = 0
+		self.rateLimited = False
+		self.history = []
+
+#Vectorized statistics of one frame: max, percentile level and roi total
+	def statistics(self, frame):
+		image = toImage(frame)
+		values = image.ravel() if self.validIndices is None else image.ravel()[self.validIndices]
+		if values.size == 0:
+			stats = {"max" : 0, "level" : 0}
+		else:
+			kth = int(round((values.size - 1) * self.percentile / 100.0))
+			stats = {
+				"max"	: int(values.max()),
+				"level"	: int(np.partition(values, kth)[kth]),
+			}
+		if self.roi is not None:
+			row0, row1, col0, col1 = self.roi
+			stats["roi"] = int(image[row0:row1, col0:col1].sum(dtype=np.int64))
+		return stats
+
+#Highest count of a frame taken with expTime
+	def ceiling(self, expTime):
+		return self.frameMax if self.frameMax is not None else self.rateMax * expTime
+
+#Exposure time (us) proposed from stats of a frame taken with expTime
+	def propose(self, stats, expTime):
+		if self.frameMax is not None and stats["max"] >= self.frameMax:
+			return expTime / self.maxStep
+		#at the pixel counter rate a shorter exposure does not help, only a shorter overflowTime
+		if stats["max"] >= self.rateMax * expTime:
+			return expTime
+		if stats["level"] > 0:
+			rate = float(stats["level"]) / expTime
+			proposed = self.target * self.ceiling(expTime) / rate
+		else:
+			#no rate to scale from, a dark or empty frame is not a reason to grow
+			proposed = expTime
+		if self.roiTarget is not None and stats.get("roi", 0) > 0:
+			proposed = min(proposed, expTime * float(self.roiTarget) / stats["roi"])
+		return proposed
+
+	def update(self, frame):
+		stats = self.statistics(frame)
+		expTime = self.expTime
+		frameSaturated = self.frameMax is not None and stats["max"] >= self.frameMax
+		self.rateLimited = not frameSaturated and stats["max"] >= self.rateMax * expTime
+		if frameSaturated or self.rateLimited:
+			self.saturated += 1
+		proposed = self.propose(stats, expTime)
+		proposed = min(max(proposed, expTime / self.maxStep), expTime * self.maxStep)
+		proposed = int(min(max(proposed, self.minTime), self.maxTime))
+		if abs(proposed - expTime) > self.deadband * expTime:
+			self.nextTime = proposed
+		else:
+			self.nextTime = expTime
+		stats["expTime"] = expTime
+		stats["next"] = self.nextTime
+		self.history.append(stats)
+		return self.nextTime
+
+#Send the proposed exposure time if it changed. Returns True when it was sent.
+	def apply(self):
+		if self.nextTime == self.expTime:
+			return False
+		self.camera.setExposureTime(self.nextTime)
+		self.expTime = self.nextTime
+		return True
+
+#Run nbExposures exposures, adapting the time between them from their last frame.
+#onFrame(frame, expTime) gets every frame. Returns the exposure times used.
+	def run(self, nbExposures, onFrame=None, timeout=None, cancelToken=None):
+		self.camera.setExposureTime(self.expTime)
+		nbFrames = self.camera.getExpectedFrameCount()
+		times = []
+		for i in range(0, nbExposures):
+			self.camera.startExposure()
+			frame = None
+			try:
+				for k in range(0, nbFrames):
+					frame = self.camera.readOneFrame(timeout, cancelToken)
+					if onFrame is not None:
+						onFrame(frame, self.expTime)
+			finally:
+				aborted = self.camera.endExposure(timeout, cancelToken)
+			if aborted:
+				raise Xpad_Error("ERROR: Exposure aborted.")
+			times.append(self.expTime)
+			if frame is not None:
+				self.update(frame)
+				self.apply()
+		return times
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+# Compatible : RebirX SERVER
+# Python version	: 3.4.3
+# Requires	 : numpy
+
+import numpy as np
+
+from libXpad import Xpad_Error
+from xpadMask import toImage
+
+
+#Normalized gain of every pixel for one detector (model and module mask), with the
+#inverse map precomputed once as float32. Pixels without usable gain get an inverse
+#of 0, which also masks them.
+class GainMap(object):
+	def __init__(self, gain, detectorModel, moduleMask, inverse=None):
+		self.gain = gain
+		self.detectorModel = str(detectorModel)
+		self.moduleMask = int(moduleMask)
+		if inverse is None:
+			inverse = np.zeros(gain.shape, dtype=np.float32)
+			np.divide(1.0, gain, out=inverse, where=gain > 0, casting='unsafe')
+		self.inverse = inverse
+
+#Raise Xpad_Error when the map was not built for this detector
+	def check(self, detectorModel, moduleMask):
+		if str(detectorModel) != self.detectorModel or int(moduleMask) != self.moduleMask:
+			raise Xpad_Error("ERROR: Flat field built for %s / mask %d, detector is %s / mask %d"
+				% (self.detectorModel, self.moduleMask, detectorModel, int(moduleMask)))
+
+#Corrected float32 frame. With out (a float32 array of the frame shape) the
+#correction is a single multiply into out, without any temporary.
+	def apply(self, frame, out=None):
+		image = toImage(frame)
+		if out is None:
+			out = np.empty(image.shape, dtype=np.float32)
+		np.multiply(image, self.inverse, out=out, dtype=np.float32)
+		return out
+
+	def save(self, fileName):
+		np.savez(fileName, gain=self.gain, inverse=self.inverse,
+			detectorModel=np.array(self.detectorModel), moduleMask=np.array(self.moduleMask))
+
+	@staticmethod
+	def load(fileName):
+		data = np.load(fileName)
+		return GainMap(data["gain"], str(data["detectorModel"]), int(data["moduleMask"]), data["inverse"])
+
+
+#Accumulate white (flat illumination) frames, transferred without server side flat
+#field correction, into a gain map normalized to the median response. Pixels in mask
+#or below minFraction of the median are left out of the map.
+class FlatFieldBuilder(object):
+	def __init__(self, mask=None, minFraction=0.05):
+		self.mask = mask
+		self.minFraction = minFraction
+		self.sum = None
+		self.count = 0
+
+	def add(self, frame):
+		image = toImage(frame)
+		if self.sum is None:
+			self.sum = np.zeros(image.shape, dtype=np.float64)
+		self.sum += image
+		self.count += 1
+
+#Run one exposure on camera and accumulate its frames. The server flat field
+#correction is switched off first.
+	def acquire(self, camera, nbImages=None):
+		camera.setFlatFieldCorrectionFlag(False)
+		if nbImages is not None:
+			camera.setNumbersOfImages(nbImages)
+		nb = camera.getExpectedFrameCount()
+		camera.startExposure()
+		try:
+			for i in range(0, nb):
+				self.add(camera.readOneFrame())
+		finally:
+			camera.endExposure()
+
+	def build(self, detectorModel, moduleMask):
+		if self.count == 0:
+			raise Xpad_Error("ERROR: No white image accumulated.")
+		mean = self.sum / self.count
+		valid = mean > 0
+		if self.mask is not None:
+			valid &= ~self.mask
+		if not valid.any():
+			raise Xpad_Error("ERROR: White images are empty.")
+		gain = mean / np.median(mean[valid])
+		valid &= gain >= self.minFraction
+		gain[~valid] = 0.0
+		return GainMap(gain, detectorModel, moduleMask)
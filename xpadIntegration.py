@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+# Compatible : RebirX SERVER
+# Python version	: 3.7
+# Requires	 : numpy
+
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from libXpad import Xpad_Error
+from xpadMask import toImage
+
+UNIT_2TH = "2th"	#scattering angle, degrees
+UNIT_R   = "r"		#distance to the beam center on the detector, mm
+
+
+#Azimuthal integration of frames into a radial profile. The bin of every pixel is
+#computed once from the geometry (beam center in pixels, sample to detector
+#distance and pixel size in mm) and the mask (bool array or xpadMask.PixelMask).
+#Masked pixels go to an extra bin that is dropped, so integrating a frame is a single
+#np.bincount over the whole frame, without any gather.
+#With cacheDir the bin map is saved there under a name derived from the geometry
+#and mask, and loaded back by any later integrator with the same setup.
+#Frames must be read with the geometrical correction on (regular pixel grid).
+class AzimuthalIntegrator(object):
+	def __init__(self, shape, centerX, centerY, distance, pixelSize=0.13, nbBins=1000, unit=UNIT_2TH, mask=None, cacheDir=None):
+		if unit not in (UNIT_2TH, UNIT_R):
+			raise Xpad_Error("ERROR: Unknown radial unit " + str(unit))
+		self.shape = tuple(shape)
+		self.geometry = (self.shape, float(centerX), float(centerY), float(distance), float(pixelSize), int(nbBins), unit)
+		self.nbBins = int(nbBins)
+		self.unit = unit
+		self.mask = None if mask is None else np.asarray(getattr(mask, "mask", mask), dtype=bool)
+		if self.mask is not None and self.mask.shape != self.shape:
+			raise Xpad_Error("ERROR: Mask shape %s does not match the frame shape %s." % (self.mask.shape, self.shape))
+		self.cacheFile = None
+		if cacheDir is not None:
+			self.cacheFile = os.path.join(cacheDir, "azimuthal_%s.npz" % self.key())
+		if self.cacheFile is not None and os.path.exists(self.cacheFile):
+			data = np.load(self.cacheFile)
+			self.bins, self.count, self.radial = data["bins"], data["count"], data["radial"]
+		else:
+			self.bins, self.count, self.radial = self.build()
+			if self.cacheFile is not None:
+				if not os.path.exists(cacheDir):
+					os.makedirs(cacheDir)
+				np.savez(self.cacheFile, bins=self.bins, count=self.count, radial=self.radial)
+		#1 / pixels per bin, 0 for the empty bins
+		self.norm = np.zeros(self.nbBins, dtype=np.float64)
+		np.divide(1.0, self.count, out=self.norm, where=self.count > 0)
+		self.stackBins = None
+
+	def key(self):
+		digest = hashlib.sha1(repr(self.geometry).encode())
+		if self.mask is not None:
+			digest.update(np.packbits(self.mask).tobytes())
+		return digest.hexdigest()[:16]
+
+	def build(self):
+		shape, centerX, centerY, distance, pixelSize, nbBins, unit = self.geometry
+		y, x = np.indices(shape, dtype=np.float64)
+		r = np.hypot((x - centerX) * pixelSize, (y - centerY) * pixelSize)
+		value = np.degrees(np.arctan2(r, distance)) if unit == UNIT_2TH else r
+		valid = np.ones(shape, dtype=bool) if self.mask is None else ~self.mask
+		if not valid.any():
+			raise Xpad_Error("ERROR: All the pixels are masked.")
+		low = value[valid].min()
+		high = value[valid].max()
+		step = (high - low) / nbBins if high > low else 1.0
+		bins = np.minimum(((value - low) / step).astype(np.int32), nbBins - 1)
+		bins[~valid] = nbBins
+		bins = bins.ravel()
+		count = np.bincount(bins, minlength=nbBins + 1)[:nbBins]
+		radial = low + (np.arange(nbBins) + 0.5) * step
+		return bins, count, radial
+
+#Mean intensity per radial bin of one frame (libXpad.Frame or (H, W) array)
+	def integrate(self, frame):
+		image = toImage(frame)
+		sums = np.bincount(self.bins, weights=image.ravel(), minlength=self.nbBins + 1)
+		return sums[:self.nbBins] * self.norm
+
+#Profiles of a (n, H, W) stack (libXpad.readImages) in one bincount: every frame
+#uses its own range of bins. Returns a (n, nbBins) array.
+	def integrateStack(self, stack):
+		n = stack.shape[0]
+		nbBins = self.nbBins + 1
+		if self.stackBins is None or self.stackBins.shape[0] != n:
+			offsets = (np.arange(n, dtype=np.int64) * nbBins).reshape(n, 1)
+			self.stackBins = self.bins.reshape(1, -1) + offsets
+		sums = np.bincount(self.stackBins.ravel(), weights=stack.reshape(n, -1).ravel(), minlength=n * nbBins)
+		return sums.reshape(n, nbBins)[:, :self.nbBins] * self.norm
+
+
+processIntegrator = None
+
+def initProcess(integrator):
+	global processIntegrator
+	processIntegrator = integrator
+
+def integrateInProcess(image):
+	return processIntegrator.integrate(image)
+
+
+#Integrate a stream of frames on a pool of workers. submit(frame) returns a future of
+#the profile, so the acquisition loop never waits for the integration. Threads share
+#the integrator; with processes=True the bin map is sent once to every worker
+#process and only the frames are pickled, which scales when bincount holds the GIL.
+class StreamIntegrator(object):
+	def __init__(self, integrator, nbWorkers=4, processes=False):
+		self.integrator = integrator
+		if processes:
+			self.executor = ProcessPoolExecutor(max_workers=nbWorkers, initializer=initProcess, initargs=(integrator,))
+			self.function = integrateInProcess
+		else:
+			self.executor = ThreadPoolExecutor(max_workers=nbWorkers)
+			self.function = integrator.integrate
+
+	def submit(self, frame):
+		return self.executor.submit(self.function, toImage(frame))
+
+	def close(self):
+		self.executor.shutdown(wait=True)
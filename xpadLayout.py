@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+# Compatible : RebirX SERVER
+# Python version	: 3.4.3
+# Requires	 : numpy
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from libXpad import Xpad_Error
+
+#Frames read without geometrical correction: one band of MODULE_HEIGHT rows per
+#module, each module made of chips of CHIP_WIDTH columns side by side
+MODULE_HEIGHT = 120
+CHIP_WIDTH    = 80
+
+
+#Number of every module present in moduleMask, in frame order
+def moduleNumbers(moduleMask):
+	moduleMask = int(moduleMask)
+	return [i for i in range(0, moduleMask.bit_length()) if moduleMask >> i & 1]
+
+
+#Position of the modules and chips in the frames of one detector (model and module
+#mask). All the accessors return views on the frame, nothing is copied:
+#- modules(image)      : (nbModules, moduleHeight, width) view
+#- module(image, n)    : (moduleHeight, width) view of module number n
+#- chips(image)        : (nbModules, moduleHeight, nbChips, chipWidth) view
+#- chip(image, n, c)   : (moduleHeight, chipWidth) view of chip c of module n
+#image is a libXpad.Frame or a C contiguous (height, width) array.
+class DetectorLayout(object):
+	def __init__(self, detectorModel, moduleMask, width, moduleHeight=MODULE_HEIGHT, chipWidth=CHIP_WIDTH):
+		if width % chipWidth:
+			raise Xpad_Error("ERROR: Frame width %d is not a number of chips." % width)
+		self.detectorModel = str(detectorModel)
+		self.moduleMask = int(moduleMask)
+		self.moduleNumbers = moduleNumbers(moduleMask)
+		self.nbModules = len(self.moduleNumbers)
+		self.moduleHeight = moduleHeight
+		self.chipWidth = chipWidth
+		self.nbChips = width // chipWidth
+		self.height = moduleHeight * self.nbModules
+		self.width = width
+		self.shape = (self.height, self.width)
+		#position of each module number in the frame
+		self.positions = dict((n, k) for k, n in enumerate(self.moduleNumbers))
+
+	def image(self, frame):
+		image = frame if isinstance(frame, np.ndarray) else frame.toArray()
+		if image.shape != self.shape:
+			raise Xpad_Error("ERROR: Frame %s does not match the %s layout %s, geometrical correction must be off."
+				% (image.shape, self.detectorModel, self.shape))
+		return image
+
+	def modules(self, frame):
+		return self.image(frame).reshape(self.nbModules, self.moduleHeight, self.width)
+
+	def module(self, frame, moduleNumber):
+		k = self.positions[moduleNumber]
+		return self.image(frame)[k * self.moduleHeight:(k + 1) * self.moduleHeight]
+
+	def chips(self, frame):
+		return self.image(frame).reshape(self.nbModules, self.moduleHeight, self.nbChips, self.chipWidth)
+
+	def chip(self, frame, moduleNumber, chip):
+		return self.module(frame, moduleNumber)[:, chip * self.chipWidth:(chip + 1) * self.chipWidth]
+
+#Per module statistics of a frame, vectorized over all the modules at once
+	def moduleStats(self, frame):
+		modules = self.modules(frame)
+		total = modules.sum(axis=(1, 2), dtype=np.int64)
+		maximum = modules.max(axis=(1, 2))
+		return dict((n, {"sum": int(total[k]), "mean": float(total[k]) / modules[k].size, "max": int(maximum[k])})
+			for k, n in enumerate(self.moduleNumbers))
+
+
+layoutCache = {}
+layoutLock = threading.Lock()
+
+#Layout of a detector model, module mask and frame width, built on the first call
+#and then shared by all the frames of that detector
+def cachedLayout(detectorModel, moduleMask, width):
+	key = (str(detectorModel), int(moduleMask), width)
+	with layoutLock:
+		if key not in layoutCache:
+			layoutCache[key] = DetectorLayout(detectorModel, moduleMask, width)
+		return layoutCache[key]
+
+#Layout of camera. With frame the width is taken from it, otherwise from the last
+#image read by the camera.
+def layoutFor(camera, frame=None):
+	moduleMask = int(camera.moduleMask) if camera.moduleMask else camera.getModuleMask()
+	if frame is not None:
+		width = frame.shape[1] if isinstance(frame, np.ndarray) else frame.width
+	else:
+		width = camera.getImageWidth()
+	detectorModel = camera.detectorModel or camera.getDetectorModel()
+	return cachedLayout(detectorModel, moduleMask, width)
+
+
+#Result of one module: value, or error when func raised. A failing module does not
+#stop the others.
+class ModuleResult(object):
+	__slots__ = ("moduleNumber", "value", "error")
+
+	def __init__(self, moduleNumber, value=None, error=None):
+		self.moduleNumber = moduleNumber
+		self.value = value
+		self.error = error
+
+	def ok(self):
+		return self.error is None
+
+
+def runModule(func, moduleNumber, view, args):
+	try:
+		return ModuleResult(moduleNumber, func(view, *args))
+	except Exception as e:
+		return ModuleResult(moduleNumber, error=e)
+
+
+#Run func(moduleView, *args) on every module of a frame, in parallel. With threads
+#the workers get zero-copy views (NumPy releases the GIL in most array operations);
+#with processes=True each module is pickled to a worker process, which pays off only
+#for pure Python or GIL bound functions, and func must be a module level function.
+#map() returns {moduleNumber: ModuleResult}.
+class ModuleProcessor(object):
+	def __init__(self, layout, nbWorkers=None, processes=False):
+		self.layout = layout
+		if nbWorkers is None:
+			nbWorkers = layout.nbModules
+		if processes:
+			self.executor = ProcessPoolExecutor(max_workers=nbWorkers)
+		else:
+			self.executor = ThreadPoolExecutor(max_workers=nbWorkers)
+
+	def map(self, func, frame, *args):
+		modules = self.layout.modules(frame)
+		futures = [self.executor.submit(runModule, func, n, modules[k], args)
+			for k, n in enumerate(self.layout.moduleNumbers)]
+		return dict((result.moduleNumber, result) for result in (f.result() for f in futures))
+
+	def close(self):
+		self.executor.shutdown(wait=True)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+# Compatible : RebirX SERVER
+# Python version	: 3.4.3
+# Requires	 : numpy
+
+import numpy as np
+
+from libXpad import Xpad_Error
+
+
+def toImage(frame):
+	if isinstance(frame, np.ndarray):
+		return frame
+	return frame.toArray()
+
+
+#Per pixel mean and variance of a stream of frames (Welford update, one vectorized
+#step per frame, constant memory).
+class PixelStats(object):
+	def __init__(self):
+		self.count = 0
+		self.mean = None
+		self.m2 = None
+
+	def add(self, frame):
+		image = toImage(frame)
+		if self.mean is None:
+			self.mean = np.zeros(image.shape, dtype=np.float64)
+			self.m2 = np.zeros(image.shape, dtype=np.float64)
+		self.count += 1
+		delta = image - self.mean
+		self.mean += delta / self.count
+		delta *= image - self.mean
+		self.m2 += delta
+
+	def variance(self):
+		if self.count < 2:
+			return np.zeros_like(self.mean)
+		return self.m2 / (self.count - 1)
+
+
+#Median of each module broadcast back to the pixels. Modules are nbModules bands of
+#rows, as in frames read without geometrical correction.
+def moduleMedian(image, nbModules):
+	result = np.empty(image.shape, dtype=np.float64)
+	for rows in np.array_split(np.arange(image.shape[0]), nbModules):
+		result[rows[0]:rows[-1] + 1] = np.median(image[rows[0]:rows[-1] + 1])
+	return result
+
+
+class PixelMask(object):
+	def __init__(self, dead, hot, noisy):
+		self.dead = dead
+		self.hot = hot
+		self.noisy = noisy
+		self.mask = dead | hot | noisy
+		#flat indices: applying the mask is a single np.put
+		self.indices = np.flatnonzero(self.mask)
+
+	def count(self):
+		return {"dead": int(self.dead.sum()), "hot": int(self.hot.sum()), "noisy": int(self.noisy.sum()), "total": int(self.indices.size)}
+
+#Set the masked pixels of image (a writable (H, W) array) to fill, in place
+	def apply(self, image, fill=0):
+		np.put(image, self.indices, fill)
+		return image
+
+	def save(self, fileName):
+		np.savez_compressed(fileName, dead=self.dead, hot=self.hot, noisy=self.noisy)
+
+	@staticmethod
+	def load(fileName):
+		data = np.load(fileName)
+		return PixelMask(data["dead"], data["hot"], data["noisy"])
+
+
+#Build a dead / hot / noisy pixel mask from dark (no beam) and flat (uniform beam)
+#acquisitions. Frames are streamed in with addDark/addFlat, build() applies:
+#- dead  : flat mean <= deadFraction x module median of the flat mean
+#- hot   : dark mean > hotCounts, or flat mean >= hotFactor x module median
+#- noisy : variance > noisyFactor x module median of the variance (dark and flat),
+#          with at least noisyMinVariance for the dark
+class PixelMaskBuilder(object):
+	def __init__(self, nbModules=1, deadFraction=0.05, hotCounts=1.0, hotFactor=10.0, noisyFactor=5.0, noisyMinVariance=1.0):
+		self.nbModules = nbModules
+		self.deadFraction = deadFraction
+		self.hotCounts = hotCounts
+		self.hotFactor = hotFactor
+		self.noisyFactor = noisyFactor
+		self.noisyMinVariance = noisyMinVariance
+		self.dark = PixelStats()
+		self.flat = PixelStats()
+
+	def addDark(self, frame):
+		self.dark.add(frame)
+
+	def addFlat(self, frame):
+		self.flat.add(frame)
+
+#Run one exposure on camera with the current settings and stream its frames to addDark or addFlat
+	def acquire(self, camera, flat, nbImages=None):
+		add = self.addFlat if flat else self.addDark
+		if nbImages is not None:
+			camera.setNumbersOfImages(nbImages)
+		nb = camera.getExpectedFrameCount()
+		camera.startExposure()
+		try:
+			for i in range(0, nb):
+				add(camera.readOneFrame())
+		finally:
+			camera.endExposure()
+
+	def build(self):
+		if self.dark.count == 0 and self.flat.count == 0:
+			raise Xpad_Error("ERROR: No frame to build the mask from.")
+		shape = (self.flat if self.flat.count else self.dark).mean.shape
+		dead = np.zeros(shape, dtype=bool)
+		hot = np.zeros(shape, dtype=bool)
+		noisy = np.zeros(shape, dtype=bool)
+		if self.flat.count:
+			mean = self.flat.mean
+			median = moduleMedian(mean, self.nbModules)
+			dead |= mean <= self.deadFraction * median
+			hot |= mean >= self.hotFactor * median
+			if self.flat.count > 1:
+				var = self.flat.variance()
+				noisy |= var > self.noisyFactor * moduleMedian(var, self.nbModules)
+		if self.dark.count:
+			hot |= self.dark.mean > self.hotCounts
+			if self.dark.count > 1:
+				var = self.dark.variance()
+				limit = np.maximum(self.noisyFactor * moduleMedian(var, self.nbModules), self.noisyMinVariance)
+				noisy |= var > limit
+		#a pixel gets a single reason, dead first then hot
+		hot &= ~dead
+		noisy &= ~(dead | hot)
+		return PixelMask(dead, hot, noisy)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+# Compatible : RebirX SERVER
+# Python version	: 3.7
+
+import collections
+import http.server
+import threading
+import time
+
+from libXpad import parseKeyValueList
+
+#Window used to compute the receive rate, in seconds
+RATE_WINDOW = 5.0
+
+
+#Acquisition metrics of one process. XpadCamera feeds it when camera.metrics is set;
+#frame consumers (writers, rings, ...) report their queue depth and dropped frames.
+#All methods are thread safe.
+class XpadMetrics(object):
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.local = threading.local()
+		self.framesReceived = 0
+		self.bytesReceived = 0
+		self.droppedFrames = 0
+		self.queueDepth = 0
+		self.detectorStatus = ""
+		self.temperatures = {}
+		self.commandCount = collections.defaultdict(int)
+		self.commandSum = collections.defaultdict(float)
+		self.commandMax = collections.defaultdict(float)
+		self.recent = collections.deque()
+
+#Run one camera command and record its duration. Nested commands (a command calling
+#another one) are only counted once, under the outermost name.
+	def timeCommand(self, method, camera, args, kwargs):
+		depth = getattr(self.local, "depth", 0)
+		if depth:
+			return method(camera, *args, **kwargs)
+		self.local.depth = 1
+		t0 = time.perf_counter()
+		try:
+			return method(camera, *args, **kwargs)
+		finally:
+			self.local.depth = 0
+			self.observeCommand(method.__name__, time.perf_counter() - t0)
+
+	def observeCommand(self, name, seconds):
+		with self.lock:
+			self.commandCount[name] += 1
+			self.commandSum[name] += seconds
+			if seconds > self.commandMax[name]:
+				self.commandMax[name] = seconds
+
+	def observeFrame(self, nbBytes):
+		now = time.monotonic()
+		with self.lock:
+			self.framesReceived += 1
+			self.bytesReceived += nbBytes
+			self.recent.append((now, nbBytes))
+			while self.recent and now - self.recent[0][0] > RATE_WINDOW:
+				self.recent.popleft()
+
+	def addDroppedFrames(self, nb=1):
+		with self.lock:
+			self.droppedFrames += nb
+
+	def setQueueDepth(self, depth):
+		self.queueDepth = depth
+
+	def setDetectorStatus(self, status):
+		self.detectorStatus = status
+
+#Accept either a {sensor: value} dictionary or the raw "key=value;" string of the server
+	def setTemperatures(self, temperatures):
+		if isinstance(temperatures, str):
+			temperatures = parseKeyValueList(temperatures)
+		values = {}
+		for key, value in temperatures.items():
+			try:
+				values[key] = float(value)
+			except (TypeError, ValueError):
+				pass
+		with self.lock:
+			self.temperatures.update(values)
+
+	def bytesPerSecond(self):
+		now = time.monotonic()
+		with self.lock:
+			while self.recent and now - self.recent[0][0] > RATE_WINDOW:
+				self.recent.popleft()
+			if not self.recent:
+				return 0.0
+			return sum(nb for t, nb in self.recent) / RATE_WINDOW
+
+#Prometheus text exposition format
+	def render(self):
+		rate = self.bytesPerSecond()
+		lines = []
+		def metric(name, kind, text, samples):
+			lines.append("# HELP " + name + " " + text)
+			lines.append("# TYPE " + name + " " + kind)
+			for labels, value in samples:
+				lines.append(name + labels + " " + repr(float(value)))
+
+		with self.lock:
+			metric("xpad_frames_received_total", "counter", "Frames received from the server.", [("", self.framesReceived)])
+			metric("xpad_bytes_received_total", "counter", "Image bytes received from the server.", [("", self.bytesReceived)])
+			metric("xpad_receive_bytes_per_second", "gauge", "Image receive rate over the last %g s." % RATE_WINDOW, [("", rate)])
+			metric("xpad_dropped_frames_total", "counter", "Frames dropped by local consumers.", [("", self.droppedFrames)])
+			metric("xpad_frame_queue_depth", "gauge", "Frames waiting in local consumer queues.", [("", self.queueDepth)])
+			metric("xpad_detector_status", "gauge", "Last detector status seen.",
+				[('{status="%s"}' % escapeLabel(self.detectorStatus), 1)] if self.detectorStatus else [])
+			metric("xpad_temperature_celsius", "gauge", "Last detector temperatures read.",
+				[('{sensor="%s"}' % escapeLabel(k), v) for k, v in sorted(self.temperatures.items())])
+			names = sorted(self.commandCount)
+			metric("xpad_command_duration_seconds", "summary", "Duration of detector commands.",
+				[('_count{command="%s"}' % n, self.commandCount[n]) for n in names] +
+				[('_sum{command="%s"}' % n, self.commandSum[n]) for n in names])
+			metric("xpad_command_duration_max_seconds", "gauge", "Longest duration of each detector command.",
+				[('{command="%s"}' % n, self.commandMax[n]) for n in names])
+		return "\n".join(lines) + "\n"
+
+
+def escapeLabel(value):
+	return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+	def do_GET(self):
+		if self.path.split("?")[0] not in ("/", "/metrics"):
+			self.send_error(404)
+			return
+		body = self.server.metrics.render().encode()
+		self.send_response(200)
+		self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass
+
+
+#HTTP endpoint serving the metrics on http://host:port/metrics from a daemon thread.
+#It binds to localhost by default.
+class MetricsServer(object):
+	def __init__(self, metrics, port=9101, host="127.0.0.1"):
+		self.metrics = metrics
+		self.httpd = http.server.ThreadingHTTPServer((host, port), MetricsRequestHandler)
+		self.httpd.daemon_threads = True
+		self.httpd.metrics = metrics
+		self.port = self.httpd.server_address[1]
+		self.thread = None
+
+	def start(self):
+		self.thread = threading.Thread(target=self.httpd.serve_forever)
+		self.thread.daemon = True
+		self.thread.start()
+		return self
+
+	def stop(self):
+		self.httpd.shutdown()
+		self.httpd.server_close()
+		if self.thread is not None:
+			self.thread.join()
+
+
+#Attach a new XpadMetrics to camera and serve it, returns the running MetricsServer
+def exportMetrics(camera, port=9101, host="127.0.0.1"):
+	metrics = XpadMetrics()
+	camera.metrics = metrics
+	return MetricsServer(metrics, port, host).start()
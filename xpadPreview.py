@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+# Compatible : RebirX SERVER
+# Python version	: 3.4.3
+# Requires	 : numpy
+
+import threading
+import time
+
+import numpy as np
+
+
+#Downsample a (H, W) frame by binning x binning blocks, reduce is "sum" or "max".
+#Rows and columns that do not fill a whole block are dropped.
+def binFrame(image, binning, reduce="sum"):
+	if binning <= 1:
+		return image
+	height = (image.shape[0] // binning) * binning
+	width = (image.shape[1] // binning) * binning
+	blocks = image[:height, :width].reshape(height // binning, binning, width // binning, binning)
+	if reduce == "max":
+		return blocks.max(axis=(1, 3))
+	return blocks.sum(axis=(1, 3), dtype=np.int64)
+
+#Map counts to uint8 on a log scale, 0 stays 0 and the maximum gives 255
+def logScale(image):
+	scaled = np.log1p(np.maximum(image, 0).astype(np.float32))
+	top = scaled.max()
+	if top > 0:
+		scaled *= 255.0 / top
+	return scaled.astype(np.uint8)
+
+
+#Preview tap on a frame source. The acquisition loop calls offer(frame) for every
+#frame: unless interval ms have passed since the last accepted frame this is a time
+#comparison and nothing else. Accepted frames are binned in a worker thread and the
+#preview is passed to every subscriber callback. Only the latest frame is kept, so a
+#slow subscriber makes previews rarer but never slows the acquisition.
+#A subscriber that raises is counted in errors and passed to onError(callback, e)
+#when given; the other subscribers still get the preview.
+class PreviewTap(object):
+	def __init__(self, interval=200, binning=4, reduce="sum", log=False, onError=None):
+		self.interval = interval / 1000.0
+		self.binning = binning
+		self.reduce = reduce
+		self.log = log
+		self.onError = onError
+		self.errors = 0
+		self.subscribers = []
+		self.lock = threading.Lock()
+		self.pending = None
+		self.latest = None
+		self.lastOffer = 0.0
+		self.running = True
+		self.wakeup = threading.Event()
+		self.thread = threading.Thread(target=self.run)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def subscribe(self, callback):
+		with self.lock:
+			self.subscribers.append(callback)
+
+	def unsubscribe(self, callback):
+		with self.lock:
+			self.subscribers.remove(callback)
+
+#frame is a libXpad.Frame or a (H, W) array. Returns True when it was taken for preview.
+	def offer(self, frame):
+		now = time.monotonic()
+		if now - self.lastOffer < self.interval:
+			return False
+		self.lastOffer = now
+		if isinstance(frame, np.ndarray):
+			image = frame.copy()
+		else:
+			image = frame.toArray()
+		with self.lock:
+			self.pending = image
+		self.wakeup.set()
+		return True
+
+	def run(self):
+		while self.running:
+			self.wakeup.wait()
+			self.wakeup.clear()
+			with self.lock:
+				image = self.pending
+				self.pending = None
+				subscribers = list(self.subscribers)
+			if image is None:
+				continue
+			preview = binFrame(image, self.binning, self.reduce)
+			if self.log:
+				preview = logScale(preview)
+			self.latest = preview
+			for callback in subscribers:
+				try:
+					callback(preview)
+				except Exception as e:
+					self.errors += 1
+					if self.onError is not None:
+						self.onError(callback, e)
+
+	def close(self):
+		self.running = False
+		self.wakeup.set()
+		self.thread.join()
@@ -0,0 +1,538 @@
+#!/usr/bin/env python3
+
+# Compatible : RebirX SERVER
+# Python version	: 3.4.3
+
+#Local proxy holding the only two connections to a RebirX server:
+#	xpadProxy.py 192.168.0.15 --listen-port 3457
+#Local programs connect to it as to the server, XpadCamera("127.0.0.1", 3457):
+#- control commands of all the clients are serialized on the main connection, an
+#  exposure (StartExposure to its final response) being a single command
+#- status and temperature queries are answered from one shared cache, refreshed on
+#  the status connection at most every statusMaxAge seconds (and by a poller when
+#  pollPeriod is set); AbortCurrentProcess is always forwarded at once
+#- a connection sending "SubscribeFrames" gets a copy of every frame relayed to the
+#  client running the exposure (see FrameSubscription)
+#- a client that does not read or acknowledge its answers within clientTimeout seconds
+#  is disconnected, its exposure aborted, so it can not hold the main connection
+#- Exit only closes the connection of that client; the Init of a client's status
+#  socket is answered with the response of the Init of its main socket
+
+import argparse
+import collections
+import select
+import socket
+import struct
+import sys
+import threading
+import time
+
+from libXpad import XpadCamera
+from libXpad import Xpad_Error
+from libXpad import Xpad_Timeout
+from libXpad import Frame
+from libXpad import AcqMode
+from libXpad import TcpTransport
+from libXpad import CHUNK_SIZE
+from libXpad import BUFFER_SIZE
+
+#Commands answered on the status connection, and those of them served from the cache
+STATUS_COMMANDS = ("GetDetectorStatus", "AbortCurrentProcess", "readCtnTemperature", "ReadDetectorTemperature", "GetDetInformation")
+CACHED_COMMANDS = ("GetDetectorStatus", "readCtnTemperature", "ReadDetectorTemperature", "GetDetInformation")
+#Commands followed by a <i length and a file from the client
+UPLOAD_COMMANDS = ("LoadConfigGFromFile", "LoadConfigLFromFile")
+#Answers of the main connection that are not a single response up to ">": "line" is
+#one line sent before the response
+RESPONSE_SHAPES = {
+	"LoadConfigLFromFile"	: ("line", "response"),
+}
+#Commands answered by <ii sizes and a file, acknowledged by the client
+DOWNLOAD_COMMANDS = ("ReadConfigL",)
+#Commands answered by frames, each acknowledged by the client, then a response
+FRAME_COMMANDS = ("StartExposure", "DigitalTest")
+SUBSCRIBE_COMMAND = "SubscribeFrames"
+#Sent by XpadCamera.close() on both its sockets: only that client is disconnected
+EXIT_COMMAND = "Exit"
+#XpadCamera.init() sends Init on its main then on its status socket; an Init less than
+#INIT_MAX_AGE s after the last one is answered with its response, not sent again
+INIT_COMMAND = "Init"
+INIT_MAX_AGE = 1.0
+#Commands setting what the number of frames of an exposure depends on. Their values
+#are taken from the commands relayed, the server is asked only for the unknown ones.
+FRAME_COUNT_SETTINGS = ("SetImageNumber", "SetAcquisitionMode", "SetBurstNumber")
+
+FRAME_HEADER = struct.Struct('<iii')
+ACK = "OK\n".encode()
+#Errors kept by the proxy, see XpadProxy.errors
+ERROR_HISTORY = 100
+
+
+#Buffered reads on one socket
+class Stream(object):
+	def __init__(self, sock):
+		self.sock = sock
+		self.buffer = bytearray()
+
+#deadline (time.monotonic()) bounds the wait, Xpad_Timeout is raised past it
+	def fill(self, deadline=None):
+		if deadline is not None:
+			readable, w, x = select.select([self.sock], [], [], max(deadline - time.monotonic(), 0))
+			if not readable:
+				raise Xpad_Timeout("ERROR: Timeout waiting for the peer.")
+		data = self.sock.recv(CHUNK_SIZE)
+		if not data:
+			raise Xpad_Error("ERROR: Connection closed.")
+		self.buffer += data
+
+	def take(self, size):
+		data = bytes(self.buffer[:size])
+		del self.buffer[:size]
+		return data
+
+	def readLine(self, deadline=None):
+		while self.buffer.find(b"\n") == -1:
+			self.fill(deadline)
+		return self.take(self.buffer.find(b"\n") + 1)
+
+	def readExact(self, size):
+		while len(self.buffer) < size:
+			self.fill()
+		return self.take(size)
+
+	def readResponse(self):
+		while self.buffer.find(b">") == -1:
+			self.fill()
+		return self.take(self.buffer.find(b">") + 1)
+
+#Forward size bytes to dest. With collect the bytes are also returned.
+	def relay(self, size, dest, collect=False):
+		data = bytearray() if collect else None
+		while size > 0:
+			if not self.buffer:
+				self.fill()
+			chunk = self.take(min(size, len(self.buffer)))
+			dest.sendall(chunk)
+			if collect:
+				data += chunk
+			size -= len(chunk)
+		return data
+
+
+
+#Copy of the relayed frames for one subscriber connection. Only depth frames are
+#queued: a slow subscriber loses the oldest ones (counted in dropped), the exposure
+#is never slowed down.
+class Subscription(object):
+	def __init__(self, conn, depth=4):
+		self.conn = conn
+		self.queue = collections.deque(maxlen=depth)
+		self.condition = threading.Condition()
+		self.dropped = 0
+		self.running = True
+		self.thread = threading.Thread(target=self.run)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def put(self, message):
+		with self.condition:
+			if len(self.queue) == self.queue.maxlen:
+				self.dropped += 1
+			self.queue.append(message)
+			self.condition.notify()
+
+	def run(self):
+		try:
+			while True:
+				with self.condition:
+					while self.running and not self.queue:
+						self.condition.wait()
+					if not self.running:
+						return
+					message = self.queue.popleft()
+				self.conn.sendall(message)
+		except OSError:
+			pass
+		finally:
+			self.running = False
+			self.conn.close()
+
+	def close(self):
+		with self.condition:
+			self.running = False
+			self.condition.notify()
+
+
+#Responses of the status connection shared by all the clients. Concurrent queries of
+#the same command wait for a single upstream round trip.
+class StatusCache(object):
+	def __init__(self, camera, maxAge=0.2):
+		self.camera = camera
+		self.stream = Stream(camera.sock_status)
+		self.maxAge = maxAge
+		self.entries = {}
+		self.hits = 0
+		self.queries = 0
+
+	def forward(self, line):
+		with self.camera.statusLock:
+			self.queries += 1
+			#the camera's own status calls (abort recovery) may leave data behind
+			self.camera.clearInputStatusSocket()
+			del self.stream.buffer[:]
+			self.camera.sock_status.sendall(line + b"\n")
+			return self.stream.readResponse()
+
+	def query(self, line, name):
+		if name not in CACHED_COMMANDS:
+			response = self.forward(line)
+			#the detector status changes after an abort
+			self.entries.clear()
+			return response
+		with self.camera.statusLock:
+			entry = self.entries.get(line)
+			if entry is not None and time.monotonic() - entry[0] <= self.maxAge:
+				self.hits += 1
+				return entry[1]
+			response = self.forward(line)
+			self.entries[line] = (time.monotonic(), response)
+			return response
+
+#Refresh every cached query, so that clients get fresh answers without waiting
+	def refresh(self):
+		with self.camera.statusLock:
+			lines = list(self.entries)
+		for line in lines:
+			response = self.forward(line)
+			with self.camera.statusLock:
+				self.entries[line] = (time.monotonic(), response)
+
+
+#Errors of the poller and of the recoveries are kept in errors (the last ERROR_HISTORY)
+#and counted in stats(); onError(e), when given, is called with each of them.
+class XpadProxy(object):
+	def __init__(self, ip, port, listenPort=3457, listenHost="127.0.0.1", transport=None, statusMaxAge=0.2, pollPeriod=None, subscriberDepth=4,
+			clientTimeout=10.0, onError=None):
+		self.camera = XpadCamera(ip, port, transport if transport is not None else TcpTransport())
+		self.main = Stream(self.camera.sock)
+		self.status = StatusCache(self.camera, statusMaxAge)
+		self.pollPeriod = pollPeriod
+		self.subscriberDepth = subscriberDepth
+		self.subscriptions = []
+		self.clientTimeout = clientTimeout
+		self.onError = onError
+		self.errors = collections.deque(maxlen=ERROR_HISTORY)
+		self.errorCount = 0
+		self.state = ("done", 0)
+		self.frameSettings = {}
+		self.lastInit = None
+		self.lock = threading.Lock()
+		self.clients = 0
+		self.commands = 0
+		self.frames = 0
+		self.running = True
+		self.srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		self.srv.bind((listenHost, listenPort))
+		self.srv.listen(16)
+		self.port = self.srv.getsockname()[1]
+		self.threads = []
+
+	def start(self):
+		targets = [self.serve]
+		if self.pollPeriod:
+			targets.append(self.poll)
+		for target in targets:
+			thread = threading.Thread(target=target)
+			thread.daemon = True
+			thread.start()
+			self.threads.append(thread)
+		return self
+
+	def serve(self):
+		while self.running:
+			try:
+				conn, address = self.srv.accept()
+			except OSError:
+				return
+			conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+			thread = threading.Thread(target=self.serveClient, args=(conn,))
+			thread.daemon = True
+			thread.start()
+
+	def poll(self):
+		while self.running:
+			time.sleep(self.pollPeriod)
+			try:
+				self.status.refresh()
+			except (OSError, Xpad_Error) as e:
+				self.reportError(e)
+
+	def reportError(self, error):
+		with self.lock:
+			self.errors.append(error)
+			self.errorCount += 1
+		if self.onError is not None:
+			self.onError(error)
+
+	def serveClient(self, conn):
+		with self.lock:
+			self.clients += 1
+		keep = False
+		try:
+			conn.sendall(self.camera.banner)
+			client = Stream(conn)
+			while self.running:
+				line = client.readLine().strip()
+				if not line:
+					continue
+				name = line.split()[0].decode(errors="replace")
+				if name == "OK":
+					#ACK sent by a client recovering from a timeout, outside of any exposure
+					continue
+				if name == EXIT_COMMAND:
+					return
+				if name == SUBSCRIBE_COMMAND:
+					conn.sendall("* 0\n>".encode())
+					with self.lock:
+						self.subscriptions.append(Subscription(conn, self.subscriberDepth))
+					keep = True
+					return
+				if name in STATUS_COMMANDS:
+					conn.sendall(self.status.query(line, name))
+					continue
+				with self.camera.mainLock:
+					if name == INIT_COMMAND and self.lastInit is not None and time.monotonic() - self.lastInit[0] <= INIT_MAX_AGE:
+						conn.sendall(self.lastInit[1])
+						continue
+					self.commands += 1
+					response = self.exchange(name, line, client, conn)
+					if name == INIT_COMMAND:
+						self.lastInit = (time.monotonic(), response)
+						self.frameSettings.clear()
+					elif name in FRAME_COUNT_SETTINGS:
+						self.trackSetting(name, line, response)
+		except (OSError, Xpad_Error):
+			pass
+		finally:
+			with self.lock:
+				self.clients -= 1
+			if not keep:
+				conn.close()
+
+#One command on the main connection for a client. The upstream answer is read as the
+#protocol defines it for that command. If the client goes away or is too slow in the
+#middle, the command is aborted and the main connection brought back to a message
+#boundary before the next one; state tells recover() where the answer stopped.
+	def exchange(self, name, line, client, conn):
+		sock = self.camera.sock
+		nbFrames = None
+		if name == "StartExposure":
+			nbFrames = self.expectedFrames()
+		elif name in FRAME_COMMANDS:
+			nbFrames = 1
+		#data left by a client that went away is not the answer of this command
+		self.camera.clearInputMainSocket()
+		del self.main.buffer[:]
+		self.state = ("command", 0)
+		conn.settimeout(self.clientTimeout)
+		try:
+			sock.sendall(line + b"\n")
+			if name in UPLOAD_COMMANDS:
+				header = client.readExact(4)
+				sock.sendall(header)
+				client.relay(struct.unpack('<i', header)[0], sock)
+			elif name in DOWNLOAD_COMMANDS:
+				header = self.main.readExact(8)
+				conn.sendall(header)
+				self.state = ("payload", struct.unpack('<ii', header)[1])
+				self.main.relay(self.state[1], conn)
+				self.state = ("ack", 0)
+				sock.sendall(self.readAck(client))
+			elif nbFrames is not None:
+				self.relayFrames(nbFrames, client, conn)
+			for part in RESPONSE_SHAPES.get(name, ("response",)):
+				self.state = ("response", 0)
+				data = self.main.readLine() if part == "line" else self.main.readResponse()
+				self.state = ("done", 0)
+				conn.sendall(data)
+			return data
+		finally:
+			conn.settimeout(None)
+			if self.state[0] != "done":
+				self.recover(nbFrames is not None)
+
+#Keep the value of a frame count setting accepted by the server
+	def trackSetting(self, name, line, response):
+		fields = line.split()
+		try:
+			accepted = len(fields) > 1 and int(self.camera.getAckValue(response)) > -1
+		except ValueError:
+			accepted = False
+		if accepted:
+			self.frameSettings[name] = fields[1].decode()
+		else:
+			self.frameSettings.pop(name, None)
+
+#Frames of one StartExposure, from the tracked settings. Only the settings never
+#relayed are asked to the server, once.
+	def expectedFrames(self):
+		settings = self.frameSettings
+		if "SetImageNumber" not in settings:
+			settings["SetImageNumber"] = str(self.camera.getImageNumber())
+		if "SetAcquisitionMode" not in settings:
+			settings["SetAcquisitionMode"] = self.camera.queryAcquisitionMode()
+		nb = int(settings["SetImageNumber"])
+		if settings["SetAcquisitionMode"] == AcqMode.DETECTOR_BURST:
+			if "SetBurstNumber" not in settings:
+				settings["SetBurstNumber"] = str(self.camera.getBurstNumber())
+			nb *= int(settings["SetBurstNumber"])
+		return nb
+
+#nbFrames frames, each acknowledged by the client, or fewer when an abort header (size 0)
+#comes first. The final response is read by exchange().
+	def relayFrames(self, nbFrames, client, conn):
+		sock = self.camera.sock
+		for i in range(0, nbFrames):
+			self.state = ("header", 0)
+			header = self.main.readExact(FRAME_HEADER.size)
+			size = FRAME_HEADER.unpack(header)[0]
+			self.state = ("payload", size)
+			conn.sendall(header)
+			if size:
+				with self.lock:
+					subscriptions = [s for s in self.subscriptions if s.running]
+					self.subscriptions = subscriptions
+				data = self.relayPayload(size, conn, bool(subscriptions))
+				self.frames += 1
+				for subscription in subscriptions:
+					subscription.put(header + data)
+			self.state = ("ack", 0)
+			sock.sendall(self.readAck(client))
+			if not size:
+				return
+
+#main.relay, counting in state the bytes still to come from the server
+	def relayPayload(self, size, conn, collect):
+		data = bytearray() if collect else None
+		while size > 0:
+			if not self.main.buffer:
+				self.main.fill()
+			chunk = self.main.take(min(size, len(self.main.buffer)))
+			size -= len(chunk)
+			self.state = ("payload", size)
+			conn.sendall(chunk)
+			if collect:
+				data += chunk
+		return data
+
+#Wait for the client's ACK, at most clientTimeout
+	def readAck(self, client):
+		deadline = time.monotonic() + self.clientTimeout if self.clientTimeout is not None else None
+		while client.readLine(deadline).strip() != b"OK":
+			pass
+		return ACK
+
+#Bring the main connection back to a message boundary after an interrupted exchange.
+#The bytes already buffered from the server are handed to the camera with the rest of
+#the answer still expected.
+	def recover(self, frames):
+		phase, size = self.state
+		buffered = self.take()
+		try:
+			if phase == "payload" and not frames:
+				#rest of a downloaded file
+				self.camera.discardBytes(size - len(buffered))
+				phase = "ack"
+			if phase == "ack":
+				self.camera.sock.sendall(ACK)
+				phase = "header"
+			if phase == "command" and frames:
+				phase = "header"
+			if not frames or (phase == "response" and buffered.find(b">") != -1):
+				self.camera.recoverMainSocket(None, None, sendAck=False)
+			elif phase == "header":
+				self.camera.recoverMainSocket(None, None, sendAck=True, pending=(buffered, 0, False))
+			elif phase == "payload":
+				self.camera.recoverMainSocket(None, None, sendAck=True, pending=(b"", size - len(buffered), False))
+			else:
+				self.camera.recoverMainSocket(None, None, sendAck=True, pending=(b"", 0, True))
+		except (OSError, Xpad_Error) as e:
+			self.reportError(e)
+
+	def take(self):
+		return self.main.take(len(self.main.buffer))
+
+	def stats(self):
+		with self.lock:
+			return {
+				"clients"		: self.clients,
+				"commands"		: self.commands,
+				"frames"		: self.frames,
+				"status_queries": self.status.queries,
+				"status_hits"	: self.status.hits,
+				"subscribers"	: len([s for s in self.subscriptions if s.running]),
+				"dropped"		: sum(s.dropped for s in self.subscriptions),
+				"errors"		: self.errorCount,
+			}
+
+	def stop(self):
+		self.running = False
+		self.srv.close()
+		with self.lock:
+			for subscription in self.subscriptions:
+				subscription.close()
+		self.camera.close()
+
+
+#Frames relayed by a proxy, seen from a monitor: next() returns a libXpad.Frame.
+#Frames are never acknowledged by the subscriber.
+class FrameSubscription(object):
+	def __init__(self, host, port, transport=None):
+		self.sock = (transport if transport is not None else TcpTransport()).connect(host, port)
+		self.sock.recv(BUFFER_SIZE)
+		self.sock.sendall((SUBSCRIBE_COMMAND + "\n").encode())
+		self.stream = Stream(self.sock)
+		self.stream.readResponse()
+		self.index = 0
+
+	def next(self):
+		header = self.stream.readExact(FRAME_HEADER.size)
+		headerTime = time.monotonic()
+		size, height, width = FRAME_HEADER.unpack(header)
+		data = self.stream.readExact(size)
+		frame = Frame(data, height, width, self.index, headerTime, time.monotonic())
+		self.index += 1
+		return frame
+
+	def close(self):
+		self.sock.close()
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Local proxy sharing one RebirX server connection")
+	parser.add_argument("host", help="RebirX server address")
+	parser.add_argument("-p", "--port", type=int, default=3456)
+	parser.add_argument("--listen-host", default="127.0.0.1")
+	parser.add_argument("--listen-port", type=int, default=3457)
+	parser.add_argument("--status-max-age", type=float, default=0.2, help="age in s of a cached status answer")
+	parser.add_argument("--poll-period", type=float, default=None, help="refresh the cached answers every N s")
+	args = parser.parse_args(argv)
+	try:
+		proxy = XpadProxy(args.host, args.port, args.listen_port, args.listen_host, None, args.status_max_age, args.poll_period).start()
+	except (OSError, Xpad_Error) as e:
+		print("Can not start the proxy : %s" % e, file=sys.stderr)
+		return 2
+	print("Proxy for %s:%d listening on %s:%d" % (args.host, args.port, args.listen_host, proxy.port))
+	try:
+		while True:
+			time.sleep(10)
+			print(proxy.stats())
+	except KeyboardInterrupt:
+		pass
+	finally:
+		proxy.stop()
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
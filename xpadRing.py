@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+# Compatible : RebirX SERVER
+# Python version	: 3.8
+# Requires	 : numpy
+
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from libXpad import Xpad_Error
+
+RING_MAGIC = 0x58504144524e4731		#"XPADRNG1"
+HEADER_SIZE = 64
+#header fields (int64)
+H_MAGIC		= 0
+H_SLOTS		= 1
+H_HEIGHT	= 2
+H_WIDTH		= 3
+H_LAST_SEQ	= 4
+H_CLOSED	= 5
+
+
+#Map the header, the per slot sequence numbers and the frames on a shared memory buffer
+def mapRing(buf, nbSlots, height, width):
+	header = np.ndarray((HEADER_SIZE // 8,), dtype=np.int64, buffer=buf)
+	slotSeq = np.ndarray((nbSlots,), dtype=np.int64, buffer=buf, offset=HEADER_SIZE)
+	offset = HEADER_SIZE + ((8 * nbSlots + 63) // 64) * 64
+	frames = np.ndarray((nbSlots, height, width), dtype='<i4', buffer=buf, offset=offset)
+	return header, slotSeq, frames
+
+def ringSize(nbSlots, height, width):
+	return HEADER_SIZE + ((8 * nbSlots + 63) // 64) * 64 + nbSlots * height * width * 4
+
+
+#Broadcast ring of frames in shared memory, written by the acquisition process.
+#Frame number seq goes to slot seq % nbSlots. The slot sequence number is set to -1
+#while the frame is copied, then to seq, then the last sequence of the header is
+#updated: readers check the slot sequence to detect a frame overwritten under them.
+#publish() never waits for the readers, slow readers lose frames and are told so.
+class FrameRing(object):
+	def __init__(self, name, nbSlots, height, width):
+		self.shm = shared_memory.SharedMemory(name=name, create=True, size=ringSize(nbSlots, height, width))
+		self.name = self.shm.name
+		self.header, self.slotSeq, self.frames = mapRing(self.shm.buf, nbSlots, height, width)
+		self.nbSlots = nbSlots
+		self.slotSeq[:] = -1
+		self.header[:] = 0
+		self.header[H_SLOTS] = nbSlots
+		self.header[H_HEIGHT] = height
+		self.header[H_WIDTH] = width
+		self.header[H_LAST_SEQ] = -1
+		self.header[H_MAGIC] = RING_MAGIC
+
+#frame is a libXpad.Frame, raw int32 bytes or a (height, width) array. Returns its sequence number.
+	def publish(self, frame):
+		data = getattr(frame, "data", frame)
+		if not isinstance(data, np.ndarray):
+			data = np.frombuffer(data, dtype='<i4')
+		seq = int(self.header[H_LAST_SEQ]) + 1
+		slot = seq % self.nbSlots
+		self.slotSeq[slot] = -1
+		self.frames[slot].reshape(-1)[:] = data.reshape(-1)
+		self.slotSeq[slot] = seq
+		self.header[H_LAST_SEQ] = seq
+		return seq
+
+	def close(self):
+		self.header[H_CLOSED] = 1
+		del self.header, self.slotSeq, self.frames
+		self.shm.close()
+		self.shm.unlink()
+
+
+#Consumer side, from any local process: RingReader(ring.name).
+#next() returns (seq, view) where view is a zero-copy array on the slot; once done
+#with it, isValid(seq) tells whether the writer overwrote the slot meanwhile.
+#missed counts the frames lost because the reader fell behind.
+class RingReader(object):
+	def __init__(self, name, fromLatest=True):
+		try:
+			self.shm = shared_memory.SharedMemory(name=name, track=False)
+		except TypeError:
+			#before Python 3.13 attaching registers the segment in the resource tracker,
+			#which would unlink it when this process exits
+			self.shm = shared_memory.SharedMemory(name=name)
+			from multiprocessing import resource_tracker
+			resource_tracker.unregister(self.shm._name, "shared_memory")
+		header = np.ndarray((HEADER_SIZE // 8,), dtype=np.int64, buffer=self.shm.buf)
+		if header[H_MAGIC] != RING_MAGIC:
+			raise Xpad_Error("ERROR: Not an Xpad frame ring : " + name)
+		self.nbSlots = int(header[H_SLOTS])
+		self.height = int(header[H_HEIGHT])
+		self.width = int(header[H_WIDTH])
+		del header
+		self.header, self.slotSeq, self.frames = mapRing(self.shm.buf, self.nbSlots, self.height, self.width)
+		self.nextSeq = int(self.header[H_LAST_SEQ]) + 1 if fromLatest else 0
+		self.missed = 0
+
+	def isValid(self, seq):
+		return self.slotSeq[seq % self.nbSlots] == seq
+
+#Wait for the next frame, timeout in s (None waits forever). Raises Xpad_Error when
+#the ring is closed or on timeout.
+	def next(self, timeout=None, pollInterval=0.0005):
+		deadline = None if timeout is None else time.monotonic() + timeout
+		while True:
+			last = int(self.header[H_LAST_SEQ])
+			if last >= self.nextSeq:
+				break
+			if self.header[H_CLOSED]:
+				raise Xpad_Error("Frame ring closed")
+			if deadline is not None and time.monotonic() > deadline:
+				raise Xpad_Error("ERROR: Timeout waiting for a frame.")
+			time.sleep(pollInterval)
+		#fell behind: skip to the oldest frame still in the ring, keeping one slot of margin
+		oldest = last - self.nbSlots + 2
+		if self.nextSeq < oldest:
+			self.missed += oldest - self.nextSeq
+			self.nextSeq = oldest
+		seq = self.nextSeq
+		self.nextSeq += 1
+		if not self.isValid(seq):
+			self.missed += 1
+			return self.next(timeout, pollInterval)
+		return seq, self.frames[seq % self.nbSlots]
+
+#Same as next() but returns a private copy, checked against overwriting
+	def nextCopy(self, timeout=None):
+		while True:
+			seq, view = self.next(timeout)
+			frame = view.copy()
+			if self.isValid(seq):
+				return seq, frame
+			self.missed += 1
+
+	def close(self):
+		del self.header, self.slotSeq, self.frames
+		self.shm.close()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+# Compatible : RebirX SERVER
+# Python version	: 3.4.3
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from libXpad import Xpad_Error
+from libXpad import Xpad_Timeout
+from libXpad import DetectorStatus
+from libXpad import deadlineFrom
+
+
+#One point of a step scan. position is passed to the move callback, expTime (us) and
+#nbImages are applied to the detector when they differ from the previous point
+#(None keeps the current value), metadata is free for the callbacks.
+class ScanPoint(object):
+	def __init__(self, position, expTime=None, nbImages=None, metadata=None):
+		self.position = position
+		self.expTime = expTime
+		self.nbImages = nbImages
+		self.metadata = metadata if metadata is not None else {}
+
+
+#Timing of one point, in seconds:
+#- moveTime   : duration of the move callback (run in the background)
+#- moveWait   : part of the move the scan had to wait for, after the previous point
+#- configTime : detector commands sent for the point (0 when nothing changed)
+#- deadTime   : from the last frame of the previous point (start of the scan for the
+#               first one) to the StartExposure of this point
+#- exposureTime : from StartExposure to the last frame
+class PointReport(object):
+	__slots__ = ("index", "position", "frames", "moveTime", "moveWait", "configTime", "deadTime", "exposureTime", "status")
+
+	def __init__(self, index, position):
+		self.index = index
+		self.position = position
+		self.frames = 0
+		self.moveTime = 0.0
+		self.moveWait = 0.0
+		self.configTime = 0.0
+		self.deadTime = 0.0
+		self.exposureTime = 0.0
+		self.status = None
+
+	def __str__(self):
+		return "point %d %s : %d frames, exposure %.3f s, dead %.3f s (move %.3f, waited %.3f, config %.3f)" % (
+			self.index, self.position, self.frames, self.exposureTime, self.deadTime, self.moveTime, self.moveWait, self.configTime)
+
+
+#Step scan over points (list of ScanPoint) with the motion of the next point
+#overlapped with the end of the current one:
+#- move(point) is called in a background thread as soon as the last frame of the
+#  previous point is received, while endExposure waits for the server and the frames
+#  are written. The same thread then waits for the detector status to be Idle., so
+#  the status check costs no time on the scan thread.
+#- onFrame(point, frame) gets every libXpad.Frame; hand it to a FrameWriter (or any
+#  asynchronous writer) so that writing overlaps too.
+#- onPoint(point, report) is called after each point.
+#run() returns the list of PointReport. timeout (s) bounds every frame, the final
+#response and the wait for Idle after the move.
+class StepScan(object):
+	def __init__(self, camera, points, move=None, onFrame=None, onPoint=None, timeout=None, cancelToken=None, statusPollInterval=0.01):
+		self.camera = camera
+		self.points = list(points)
+		self.move = move
+		self.onFrame = onFrame
+		self.onPoint = onPoint
+		self.timeout = timeout
+		self.cancelToken = cancelToken
+		self.statusPollInterval = statusPollInterval
+		self.expTime = None
+		self.nbImages = None
+		self.nbFrames = None
+		self.reports = []
+
+#Move to point then wait for the detector to be Idle., in the background thread
+	def prepare(self, point):
+		start = time.monotonic()
+		if self.move is not None:
+			self.move(point)
+		moveTime = time.monotonic() - start
+		deadline = deadlineFrom(self.timeout)
+		while True:
+			status = self.camera.getDetectorStatus()
+			if status.find(DetectorStatus.IDLE) != -1:
+				break
+			if status == "ERROR STATUS":
+				raise Xpad_Error("ERROR: Detector status unreadable before point " + str(point.position))
+			if deadline is not None and time.monotonic() > deadline:
+				raise Xpad_Timeout("ERROR: Detector not Idle before point " + str(point.position))
+			time.sleep(self.statusPollInterval)
+		return moveTime, status
+
+#Send only the parameters that changed, returns the number of frames of the point
+	def configure(self, point):
+		changed = False
+		if point.expTime is not None and point.expTime != self.expTime:
+			self.camera.setExposureTime(point.expTime)
+			self.expTime = point.expTime
+			changed = True
+		if point.nbImages is not None and point.nbImages != self.nbImages:
+			self.camera.setNumbersOfImages(point.nbImages)
+			self.nbImages = point.nbImages
+			changed = True
+		if changed or self.nbFrames is None:
+			self.nbFrames = self.camera.getExpectedFrameCount()
+		return self.nbFrames
+
+	def run(self):
+		self.reports = []
+		if not self.points:
+			return self.reports
+		mover = ThreadPoolExecutor(max_workers=1)
+		try:
+			pending = mover.submit(self.prepare, self.points[0])
+			lastFrameTime = time.monotonic()
+			for i, point in enumerate(self.points):
+				report = PointReport(i, point.position)
+				start = time.monotonic()
+				report.moveTime, report.status = pending.result()
+				report.moveWait = time.monotonic() - start
+				pending = None
+
+				start = time.monotonic()
+				nbFrames = self.configure(point)
+				report.configTime = time.monotonic() - start
+
+				exposureStart = time.monotonic()
+				report.deadTime = exposureStart - lastFrameTime
+				self.camera.startExposure()
+				try:
+					for k in range(0, nbFrames):
+						frame = self.camera.readOneFrame(self.timeout, self.cancelToken)
+						report.frames += 1
+						if self.onFrame is not None:
+							self.onFrame(point, frame)
+					lastFrameTime = time.monotonic()
+					#all the images of the point are taken: start the next move now
+					if i + 1 < len(self.points):
+						pending = mover.submit(self.prepare, self.points[i + 1])
+				finally:
+					aborted = self.camera.endExposure(self.timeout, self.cancelToken)
+				report.exposureTime = lastFrameTime - exposureStart
+				self.reports.append(report)
+				if aborted:
+					raise Xpad_Error("ERROR: Scan aborted at point " + str(point.position))
+				if self.onPoint is not None:
+					self.onPoint(point, report)
+		finally:
+			mover.shutdown(wait=True)
+		return self.reports
+
+#Total and mean dead time of the last run, in seconds
+	def deadTime(self):
+		total = sum(report.deadTime for report in self.reports)
+		return {"total": total, "mean": total / len(self.reports) if self.reports else 0.0,
+			"max": max(report.deadTime for report in self.reports) if self.reports else 0.0}
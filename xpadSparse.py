@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+# Compatible : RebirX SERVER
+# Python version	: 3.4.3
+# Requires	 : numpy
+
+import os
+import struct
+
+import numpy as np
+
+from libXpad import Xpad_Error
+from libXpad import Frame
+from xpadMask import toImage
+
+#Record header of a frame file: magic, kind, height, width, frame index, number of
+#stored pixels (sparse only), counts type
+RECORD_MAGIC  = b"XPFR"
+RECORD_HEADER = struct.Struct('<4sBiiiiB')
+KIND_DENSE    = 0
+KIND_SPARSE   = 1
+COUNT_TYPES   = {0: np.dtype('<u1'), 1: np.dtype('<u2'), 2: np.dtype('<i4')}
+
+
+#Smallest counts type holding all the values
+def countType(values):
+	if values.size == 0 or (values.min() >= 0 and values.max() <= 0xff):
+		return 0
+	if values.min() >= 0 and values.max() <= 0xffff:
+		return 1
+	return 2
+
+
+#Non zero pixels of a frame: flat pixel indices (uint32, increasing) and counts
+#(uint8, uint16 or int32, the smallest that fits).
+class SparseFrame(object):
+	__slots__ = ("indices", "counts", "height", "width", "index")
+
+	def __init__(self, indices, counts, height, width, index=0):
+		self.indices = indices
+		self.counts = counts
+		self.height = height
+		self.width = width
+		self.index = index
+
+	@staticmethod
+	def fromDense(frame, index=None):
+		image = toImage(frame)
+		flat = image.ravel()
+		indices = np.flatnonzero(flat).astype('<u4')
+		values = flat[indices]
+		counts = values.astype(COUNT_TYPES[countType(values)])
+		if index is None:
+			index = getattr(frame, "index", 0)
+		return SparseFrame(indices, counts, image.shape[0], image.shape[1], index)
+
+	def toDense(self, out=None):
+		if out is None:
+			out = np.zeros((self.height, self.width), dtype='<i4')
+		else:
+			out.fill(0)
+		out.ravel()[self.indices] = self.counts
+		return out
+
+	def occupancy(self):
+		return float(self.indices.size) / (self.height * self.width)
+
+	def nbytes(self):
+		return self.indices.nbytes + self.counts.nbytes
+
+
+#Bytes taken by nbHits non zero pixels stored sparse: uint32 index and counts of
+#itemSize bytes
+def sparseSize(nbHits, itemSize=2):
+	return nbHits * (4 + itemSize)
+
+#Encode frame as a SparseFrame when that takes at most maxRatio of the dense size,
+#otherwise return the (H, W) int32 array. The occupancy and the counts type (the one
+#of the whole frame is the one of its non zero pixels) are found first, so dense
+#frames are not extracted for nothing. index defaults to frame.index, or 0.
+def encodeFrame(frame, maxRatio=0.5, index=None):
+	image = toImage(frame)
+	nbHits = np.count_nonzero(image)
+	itemSize = COUNT_TYPES[countType(image)].itemsize
+	if sparseSize(nbHits, itemSize) > maxRatio * image.size * 4:
+		return image
+	if index is None:
+		index = getattr(frame, "index", 0)
+	return SparseFrame.fromDense(image, index)
+
+
+#Frames appended to a single file, each one stored dense or sparse by encodeFrame.
+#write() takes a libXpad.Frame, a (H, W) array or a SparseFrame; stats() compares the
+#bytes written with the dense size.
+class SparseWriter(object):
+	def __init__(self, fileName, maxRatio=0.5):
+		directory = os.path.dirname(fileName)
+		if directory and not os.path.exists(directory):
+			os.makedirs(directory)
+		self.fd = open(fileName, 'wb')
+		self.maxRatio = maxRatio
+		self.frames = 0
+		self.sparse = 0
+		self.bytes = 0
+		self.denseBytes = 0
+
+	def write(self, frame):
+		index = getattr(frame, "index", self.frames)
+		if not isinstance(frame, SparseFrame):
+			frame = encodeFrame(frame, self.maxRatio, index)
+		if isinstance(frame, SparseFrame):
+			code = countType(frame.counts)
+			header = RECORD_HEADER.pack(RECORD_MAGIC, KIND_SPARSE, frame.height, frame.width, frame.index, frame.indices.size, code)
+			self.fd.write(header)
+			self.fd.write(frame.indices.tobytes())
+			self.fd.write(frame.counts.astype(COUNT_TYPES[code], copy=False).tobytes())
+			size = len(header) + frame.nbytes()
+			self.sparse += 1
+			height, width = frame.height, frame.width
+		else:
+			height, width = frame.shape
+			header = RECORD_HEADER.pack(RECORD_MAGIC, KIND_DENSE, height, width, index, 0, 2)
+			self.fd.write(header)
+			self.fd.write(np.ascontiguousarray(frame, dtype='<i4').tobytes())
+			size = len(header) + height * width * 4
+		self.frames += 1
+		self.bytes += size
+		self.denseBytes += height * width * 4
+
+	def stats(self):
+		return {
+			"frames"	: self.frames,
+			"sparse"	: self.sparse,
+			"bytes"		: self.bytes,
+			"ratio"		: float(self.denseBytes) / self.bytes if self.bytes else None,
+		}
+
+	def close(self):
+		self.fd.close()
+
+
+#Read a file of SparseWriter. Iterating gives the frames in file order with their
+#index, libXpad.Frame (no timing) or SparseFrame objects as stored; with dense=True
+#all the frames are returned as libXpad.Frame.
+class SparseReader(object):
+	def __init__(self, fileName, dense=False):
+		self.fd = open(fileName, 'rb')
+		self.dense = dense
+
+	def readFrame(self):
+		header = self.fd.read(RECORD_HEADER.size)
+		if not header:
+			return None
+		if len(header) < RECORD_HEADER.size:
+			raise Xpad_Error("ERROR: Truncated frame file.")
+		magic, kind, height, width, index, nbHits, code = RECORD_HEADER.unpack(header)
+		if magic != RECORD_MAGIC or code not in COUNT_TYPES:
+			raise Xpad_Error("ERROR: Not a frame record.")
+		if kind == KIND_DENSE:
+			return Frame(self.readArray(np.dtype('<i4'), height * width), height, width, index, None, None)
+		indices = self.readArray(np.dtype('<u4'), nbHits)
+		counts = self.readArray(COUNT_TYPES[code], nbHits)
+		frame = SparseFrame(indices, counts, height, width, index)
+		if self.dense:
+			return Frame(frame.toDense(), height, width, index, None, None)
+		return frame
+
+	def readArray(self, dtype, count):
+		data = self.fd.read(dtype.itemsize * count)
+		if len(data) != dtype.itemsize * count:
+			raise Xpad_Error("ERROR: Truncated frame file.")
+		return np.frombuffer(data, dtype=dtype)
+
+	def __iter__(self):
+		while True:
+			frame = self.readFrame()
+			if frame is None:
+				return
+			yield frame
+
+	def close(self):
+		self.fd.close()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+# Compatible : RebirX SERVER
+# Python version	: 3.4.3
+
+import collections
+import re
+import threading
+import time
+
+from libXpad import Xpad_Error
+from libXpad import DetInformation
+from libXpad import parseKeyValueList
+
+TEMPERATURE_COMMANDS = ("readCtnTemperature", "ReadDetectorTemperature")
+
+
+#Module number of a telemetry key ("Module_3", "mod3", "T3", ...), None if the key has no number
+def moduleOf(key):
+	match = re.search(r'(\d+)\D*$', key)
+	if match is None:
+		return None
+	return int(match.group(1))
+
+
+#Numeric values of a "key=value;key=value;" list, prefixed by source. Values that are
+#not numbers are dropped.
+def parseTelemetry(source, text):
+	record = {}
+	for key, value in parseKeyValueList(text).items():
+		try:
+			record[source + "." + key] = float(value)
+		except ValueError:
+			pass
+	return record
+
+
+#Poll temperatures and detector information on the status connection every period
+#seconds, so that the image stream on the main connection is never delayed. Samples
+#are kept in a fixed-size ring of (time, {key: value}) records. A failed query (server
+#error or socket error) is counted in errors and the sampling goes on.
+class TelemetrySampler(object):
+	def __init__(self, camera, period=1.0, size=3600, commands=TEMPERATURE_COMMANDS, informations=(DetInformation.HV_CONSIGNE,), metrics=None):
+		self.camera = camera
+		self.period = period
+		self.commands = list(commands)
+		self.informations = list(informations)
+		self.metrics = metrics
+		self.samples = collections.deque(maxlen=size)
+		self.lock = threading.Lock()
+		self.errors = 0
+		self.stopEvent = threading.Event()
+		self.thread = None
+
+	def start(self):
+		self.stopEvent.clear()
+		self.thread = threading.Thread(target=self.run)
+		self.thread.daemon = True
+		self.thread.start()
+		return self
+
+	def stop(self):
+		self.stopEvent.set()
+		if self.thread is not None:
+			self.thread.join()
+
+	def run(self):
+		nextTime = time.monotonic()
+		while not self.stopEvent.is_set():
+			self.sample()
+			nextTime += self.period
+			self.stopEvent.wait(max(nextTime - time.monotonic(), 0))
+
+#Take one sample now and return it
+	def sample(self):
+		record = {}
+		for command in self.commands:
+			try:
+				record.update(parseTelemetry(command, self.camera.statusQuery(command)))
+			except (Xpad_Error, OSError):
+				self.errors += 1
+		for name in self.informations:
+			try:
+				value = self.camera.statusQuery("GetDetInformation " + name)
+				record["GetDetInformation." + name] = float(value)
+			except (Xpad_Error, ValueError, OSError):
+				self.errors += 1
+		now = time.time()
+		with self.lock:
+			self.samples.append((now, record))
+		if self.metrics is not None:
+			self.metrics.setTemperatures(dict((k, v) for k, v in record.items() if k.startswith(TEMPERATURE_COMMANDS)))
+		return record
+
+	def latest(self):
+		with self.lock:
+			return self.samples[-1] if self.samples else None
+
+	def keys(self):
+		with self.lock:
+			keys = set()
+			for t, record in self.samples:
+				keys.update(record)
+		return sorted(keys)
+
+#[(time, value)] of key over the last seconds (all the ring if None)
+	def history(self, key, seconds=None):
+		since = None if seconds is None else time.time() - seconds
+		with self.lock:
+			return [(t, record[key]) for t, record in self.samples if key in record and (since is None or t >= since)]
+
+	def stats(self, key, seconds=None):
+		values = [v for t, v in self.history(key, seconds)]
+		if not values:
+			return None
+		return {"min": min(values), "max": max(values), "mean": sum(values) / len(values), "count": len(values)}
+
+#{module: {key: value}} of the latest sample, keys without module number under None
+	def byModule(self):
+		latest = self.latest()
+		modules = collections.defaultdict(dict)
+		if latest is not None:
+			for key, value in latest[1].items():
+				modules[moduleOf(key.split(".", 1)[1])][key] = value
+		return dict(modules)
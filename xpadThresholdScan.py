@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+# Compatible : RebirX SERVER
+# Python version	: 3.4.3
+# Requires	 : numpy
+
+import queue
+import threading
+
+import numpy as np
+
+from libXpad import Xpad_Error
+from libXpad import Global_Config
+
+
+#Fit one S-curve per pixel on a (steps, H, W) count cube.
+#The derivative of an S-curve along the threshold axis is a peak: its centroid is
+#the edge position and its standard deviation the edge width. Everything is done
+#with whole-cube NumPy operations, there is no loop over pixels.
+#Pixels without any count variation get NaN for both edge and width.
+def fitSCurves(thresholds, cube):
+	thresholds = np.asarray(thresholds, dtype=np.float64)
+	order = np.argsort(thresholds, kind='stable')
+	thresholds = thresholds[order]
+	cube = np.asarray(cube)[order]
+
+	#Orient every pixel so that its S-curve is falling, whatever the register direction
+	diff = np.diff(cube.astype(np.float64), axis=0)
+	falling = cube[-1].astype(np.float64) <= cube[0]
+	diff *= np.where(falling, -1.0, 1.0)
+	np.clip(diff, 0, None, out=diff)
+
+	centers = (thresholds[1:] + thresholds[:-1]) / 2
+	total = diff.sum(axis=0)
+	with np.errstate(invalid='ignore', divide='ignore'):
+		edge  = np.tensordot(centers, diff, axes=1) / total
+		var   = np.tensordot(centers * centers, diff, axes=1) / total - edge * edge
+	width = np.sqrt(np.clip(var, 0, None))
+	edge[total == 0]  = np.nan
+	width[total == 0] = np.nan
+	return edge, width
+
+
+class ThresholdScanResult(object):
+	def __init__(self, thresholds, cube):
+		self.thresholds = np.asarray(thresholds)
+		self.cube = cube
+		self.edge, self.width = fitSCurves(self.thresholds, cube)
+
+	#Return the counts of one pixel for every threshold step
+	def sCurve(self, row, col):
+		return self.cube[:, row, col]
+
+
+#Threshold sweep on a global register (ITHL by default).
+#For every threshold value the register is loaded, nbImages frames are acquired
+#and summed into a (steps, H, W) cube. Frame decoding and accumulation run in a
+#worker thread, so the configuration and exposure of step N+1 overlap the
+#processing of step N.
+class ThresholdScan(object):
+	def __init__(self, camera, thresholds, nbImages=1, register=Global_Config.ITHL, dtype=np.int32):
+		self.camera = camera
+		self.thresholds = list(thresholds)
+		self.nbImages = nbImages
+		self.register = register
+		self.dtype = dtype
+		self.cube = None
+
+	def _accumulate(self, frames, errors):
+		try:
+			while True:
+				item = frames.get()
+				if item is None:
+					return
+				step, data, height, width = item
+				frame = np.frombuffer(data, dtype='<i4').reshape(height, width)
+				if self.cube is None:
+					self.cube = np.zeros((len(self.thresholds), height, width), dtype=self.dtype)
+				self.cube[step] += frame
+		except Exception as e:
+			errors.append(e)
+			#keep draining so that the acquisition loop never blocks on a full queue
+			while frames.get() is not None:
+				pass
+
+#progress(step, nbSteps, value) is called after the frames of each step are read.
+	def run(self, progress=None):
+		if not self.thresholds:
+			raise Xpad_Error("ERROR: Empty threshold list.")
+		self.cube = None
+		frames = queue.Queue(maxsize=4 * self.nbImages)
+		errors = []
+		worker = threading.Thread(target=self._accumulate, args=(frames, errors))
+		worker.daemon = True
+		worker.start()
+		try:
+			self.camera.setNumbersOfImages(self.nbImages)
+			for step, value in enumerate(self.thresholds):
+				ret = self.camera.loadConfigG(self.register, str(value))
+				try:
+					ret = int(ret)
+				except (TypeError, ValueError):
+					ret = -1
+				if ret < 0:
+					raise Xpad_Error("ERROR => Threshold scan : LoadConfigG " + self.register + " " + str(value) + " refused.")
+				self.camera.startExposure()
+				try:
+					for i in range(0, self.nbImages):
+						data = self.camera.readOneImage()
+						frames.put((step, data, self.camera.getImageHeight(), self.camera.getImageWidth()))
+				finally:
+					#always release the main socket, even when the server aborts the exposure
+					aborted = self.camera.endExposure()
+				if aborted:
+					raise Xpad_Error("ERROR => Threshold scan : Exposure aborted.")
+				if progress:
+					progress(step + 1, len(self.thresholds), value)
+				if errors:
+					break
+		finally:
+			frames.put(None)
+			worker.join()
+		if errors:
+			raise Xpad_Error("ERROR => Threshold scan : " + str(errors[0]))
+		return ThresholdScanResult(self.thresholds, self.cube)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+# Compatible : RebirX SERVER
+# Python version	: 3.4.3
+# Requires	 : numpy
+
+import threading
+import time
+
+from libXpad import Xpad_Error
+from libXpad import Xpad_Timeout
+from libXpad import TriggerMode
+from libXpad import ABORT_TIMEOUT
+from libXpad import percentile
+
+
+#Frames produced by one trigger: images is a (framesPerTrigger, H, W) int32 array,
+#headerTimes the monotonic arrival time of every frame header.
+class TriggerGroup(object):
+	__slots__ = ("index", "images", "headerTimes")
+
+	def __init__(self, index, images, headerTimes):
+		self.index = index
+		self.images = images
+		self.headerTimes = headerTimes
+
+#Arrival of the first frame of the group, the closest to the trigger seen by the client
+	def arrival(self):
+		return self.headerTimes[0]
+
+
+#Acquisition driven by an external trigger, used as a context manager:
+#	with TriggeredAcquisition(camera, 100) as acquisition:
+#		for group in acquisition.groups():
+#			...
+#Entering arms it: the input trigger mode, the output signal and the image number are
+#set, then the exposure started; groups() yields one TriggerGroup per trigger and
+#leaving the block ends the exposure and restores the previous input signal (close()). Nothing is sent to the server between triggers apart from
+#the ACK of every frame, and each group is read into its array in one readImages call.
+#- EXTERNAL_MULTI_TRIGGER : every trigger takes framesPerTrigger images
+#- EXTERNAL_STACK_TRIGGER : every trigger adds to the stacked image, use framesPerTrigger
+#                           for the images sent per trigger
+#- EXTERNAL_SINGLE_TRIGGER: one trigger takes the whole sequence, use nbTriggers=1
+#firstTriggerTimeout (s) bounds the wait for the first trigger after arm(), then
+#triggerTimeout bounds every following group. A missing trigger aborts the exposure
+#and raises Xpad_Timeout with the trigger number in e.trigger.
+#The main socket stays locked from arm() to close(). Both, and groups(), must run on
+#the thread that armed the acquisition: the lock is an RLock of that thread, so it is
+#never released from a generator finalizer. arm() used without the with statement
+#must be paired with close() in a finally.
+class TriggeredAcquisition(object):
+	def __init__(self, camera, nbTriggers, framesPerTrigger=1, triggerMode=TriggerMode.EXTERNAL_MULTI_TRIGGER,
+			outputSignal=None, triggerTimeout=None, firstTriggerTimeout=None, cancelToken=None):
+		if triggerMode == TriggerMode.INTERNAL:
+			raise Xpad_Error("ERROR: Triggered acquisition needs an external trigger mode.")
+		self.camera = camera
+		self.nbTriggers = nbTriggers
+		self.framesPerTrigger = framesPerTrigger
+		self.triggerMode = triggerMode
+		self.outputSignal = outputSignal
+		self.triggerTimeout = triggerTimeout
+		self.firstTriggerTimeout = firstTriggerTimeout
+		self.cancelToken = cancelToken
+		self.armed = False
+		self.owner = None
+		self.previousInput = None
+		self.armTime = None
+		self.arrivals = []
+		self.received = 0
+
+	def arm(self):
+		#input signal last set by this camera, internal when never set
+		self.previousInput = self.camera.inputSignal or TriggerMode.INTERNAL
+		if not self.camera.setInputSignal(self.triggerMode):
+			raise Xpad_Error("ERROR: Input signal " + self.triggerMode + " refused.")
+		try:
+			if self.outputSignal is not None and not self.camera.setOutputSignal(self.outputSignal):
+				raise Xpad_Error("ERROR: Output signal " + self.outputSignal + " refused.")
+			self.camera.setNumbersOfImages(self.nbTriggers * self.framesPerTrigger)
+			self.arrivals = []
+			self.received = 0
+			self.camera.startExposure()
+		except:
+			self.camera.setInputSignal(self.previousInput)
+			raise
+		self.armed = True
+		self.owner = threading.current_thread()
+		self.armTime = time.monotonic()
+
+	def __enter__(self):
+		self.arm()
+		return self
+
+	def __exit__(self, excType, excValue, traceback):
+		self.close()
+		return False
+
+	def checkOwner(self):
+		if not self.armed:
+			raise Xpad_Error("ERROR: Triggered acquisition not armed.")
+		if self.owner is not threading.current_thread():
+			raise Xpad_Error("ERROR: Triggered acquisition used outside the thread that armed it.")
+
+	def groups(self):
+		self.checkOwner()
+		for i in range(self.received, self.nbTriggers):
+			timeout = self.firstTriggerTimeout if i == 0 else self.triggerTimeout
+			headerTimes = []
+			try:
+				images = self.camera.readImages(self.framesPerTrigger, timeout, self.cancelToken, headerTimes=headerTimes)
+			except Xpad_Timeout as e:
+				e.trigger = i
+				raise
+			self.arrivals.append(headerTimes[0])
+			self.received += 1
+			yield TriggerGroup(i, images, headerTimes)
+
+	def __iter__(self):
+		return self.groups()
+
+#End the exposure, release the main socket and restore the input signal in use before
+#arm(); returns 1 when the exposure was aborted. When fewer than nbTriggers groups
+#were read the exposure is aborted first. The final response is waited for at most
+#triggerTimeout (ABORT_TIMEOUT without one), so a failed recovery can not block.
+	def close(self):
+		if not self.armed:
+			return 0
+		self.checkOwner()
+		self.armed = False
+		self.owner = None
+		timeout = self.triggerTimeout if self.triggerTimeout is not None else ABORT_TIMEOUT
+		try:
+			if self.received < self.nbTriggers and not self.camera.exposureAborted:
+				self.camera.recoverMainSocket(None, self.cancelToken, sendAck=True)
+		finally:
+			ret = self.camera.endExposure(timeout, self.cancelToken)
+		self.camera.setInputSignal(self.previousInput)
+		return ret
+
+#Back to the internal trigger, for the acquisitions that follow
+	def restoreInternal(self):
+		self.camera.setInputSignal(TriggerMode.INTERNAL)
+
+#Trigger rate and intervals seen by the client (s), from the arrival of the groups
+	def summary(self):
+		intervals = sorted(b - a for a, b in zip(self.arrivals, self.arrivals[1:]))
+		span = self.arrivals[-1] - self.arrivals[0] if len(self.arrivals) > 1 else 0.0
+		return {
+			"triggers"			: len(self.arrivals),
+			"expected"			: self.nbTriggers,
+			"first_latency"		: self.arrivals[0] - self.armTime if self.arrivals else None,
+			"trigger_rate"		: (len(self.arrivals) - 1) / span if span > 0 else None,
+			"interval_median"	: percentile(intervals, 50),
+			"interval_p99"		: percentile(intervals, 99),
+			"interval_max"		: intervals[-1] if intervals else None,
+		}
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+# Compatible : RebirX SERVER
+# Python version	: 3.4.3
+
+import collections
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from libXpad import Xpad_Error
+from libXpad import percentile
+
+
+#Write frames (libXpad.Frame) to one .bin file each from a pool of threads. File
+#writes release the GIL, so several frames are written concurrently while the
+#acquisition keeps reading.
+#- the index file lists the frames in acquisition order, whatever order the writes
+#  complete in: index name size headerTime writeLatency
+#- files are fsync'ed by batches of fsyncInterval frames (0 disables fsync)
+#- write() blocks when maxBacklog frames are waiting, bounding the memory used
+#- stats() gives the write latency percentiles and the current backlog
+class FrameWriter(object):
+	def __init__(self, directory, prefix="frame", nbThreads=4, fsyncInterval=32, maxBacklog=64, metrics=None):
+		if not os.path.exists(directory):
+			os.makedirs(directory)
+		self.directory = directory
+		self.prefix = prefix
+		self.fsyncInterval = fsyncInterval
+		self.metrics = metrics
+		self.executor = ThreadPoolExecutor(max_workers=nbThreads)
+		self.slots = threading.Semaphore(maxBacklog)
+		self.lock = threading.Lock()
+		self.backlog = 0
+		self.written = 0
+		self.nbFsync = 0
+		self.latencies = collections.deque(maxlen=10000)
+		self.unsynced = []
+		self.completed = {}
+		self.nextIndex = None
+		self.error = None
+		self.indexFile = open(os.path.join(directory, prefix + "_index.txt"), 'w')
+
+	def fileName(self, index):
+		return os.path.join(self.directory, "%s%06d.bin" % (self.prefix, index))
+
+	def write(self, frame):
+		if self.error is not None:
+			raise Xpad_Error("ERROR => Frame writer : " + str(self.error))
+		self.slots.acquire()
+		with self.lock:
+			if self.nextIndex is None:
+				self.nextIndex = frame.index
+			self.backlog += 1
+			backlog = self.backlog
+		if self.metrics is not None:
+			self.metrics.setQueueDepth(backlog)
+		self.executor.submit(self.writeOne, frame, time.monotonic())
+
+	def writeOne(self, frame, submitTime):
+		try:
+			fd = open(self.fileName(frame.index), 'wb')
+			fd.write(frame.data)
+			if self.fsyncInterval:
+				fd.flush()
+			else:
+				fd.close()
+			latency = time.monotonic() - submitTime
+			toSync = None
+			with self.lock:
+				if self.fsyncInterval:
+					self.unsynced.append(fd)
+					if len(self.unsynced) >= self.fsyncInterval:
+						toSync = self.unsynced
+						self.unsynced = []
+				self.latencies.append(latency)
+				self.completed[frame.index] = (frame.index, len(frame.data), frame.headerTime, latency)
+				self.flushIndex()
+			if toSync:
+				self.sync(toSync)
+		except Exception as e:
+			self.error = e
+		finally:
+			with self.lock:
+				self.backlog -= 1
+				self.written += 1
+			self.slots.release()
+
+	#write the contiguous run of completed frames to the index, called with the lock held
+	def flushIndex(self):
+		while self.nextIndex in self.completed:
+			index, size, headerTime, latency = self.completed.pop(self.nextIndex)
+			self.indexFile.write("%d %s %d %.6f %.6f\n" % (index, os.path.basename(self.fileName(index)), size, headerTime, latency))
+			self.nextIndex += 1
+
+	#fsync and close files, counted as one fsync batch when there is any
+	def sync(self, files):
+		if not files:
+			return
+		for fd in files:
+			os.fsync(fd.fileno())
+			fd.close()
+		with self.lock:
+			self.nbFsync += 1
+
+	def stats(self):
+		with self.lock:
+			latencies = sorted(self.latencies)
+			return {
+				"written"		: self.written,
+				"backlog"		: self.backlog,
+				"fsync"			: self.nbFsync,
+				"latency_p50"	: percentile(latencies, 50),
+				"latency_p99"	: percentile(latencies, 99),
+				"latency_max"	: latencies[-1] if latencies else None,
+			}
+
+	def close(self):
+		self.executor.shutdown(wait=True)
+		with self.lock:
+			toSync = self.unsynced
+			self.unsynced = []
+			#frames missing from the sequence: write what is left in acquisition order
+			for index in sorted(self.completed):
+				self.nextIndex = index
+				self.flushIndex()
+		if toSync:
+			self.sync(toSync)
+		self.indexFile.flush()
+		os.fsync(self.indexFile.fileno())
+		self.indexFile.close()
+		if self.metrics is not None:
+			self.metrics.setQueueDepth(0)
+		if self.error is not None:
+			raise Xpad_Error("ERROR => Frame writer : " + str(self.error))